@@ -0,0 +1,61 @@
+# Memory held by a cache of 1000 symbols x 220 candles (with MA30), as the
+# compact Candles type versus the previous pandas DataFrame pipeline.
+# Run from the repo root: python -m bench.bench_candles
+import time
+import tracemalloc
+
+import numpy as np
+
+from bot.charts import Candles, add_ma30
+
+SYMBOLS = 1000
+ROWS = 220
+
+
+def fake_rows(seed: int) -> list[list[float]]:
+    rng = np.random.default_rng(seed)
+    close = np.cumprod(1 + rng.normal(0, 0.003, ROWS)) * 100
+    ts = 1_700_000_000_000 + np.arange(ROWS) * 900_000
+    return [[int(t), c, c * 1.001, c * 0.999, c, 1000.0] for t, c in zip(ts, close)]
+
+
+def build_candles(rows):
+    return add_ma30(Candles.from_rows(rows))
+
+
+def build_dataframe(rows):
+    import pandas as pd
+
+    df = pd.DataFrame(rows, columns=["ts", "open", "high", "low", "close", "volume"])
+    df["dt"] = pd.to_datetime(df["ts"], unit="ms", utc=True)
+    df = df.copy()
+    df["ma30"] = df["close"].rolling(30).mean()
+    return df
+
+
+def measure(name: str, build, inputs) -> None:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    cache = {i: build(rows) for i, rows in enumerate(inputs)}
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<10} total={current / 1e6:8.2f} MB  per_symbol={current / len(cache) / 1e3:7.1f} KB  "
+        f"peak={peak / 1e6:8.2f} MB  build={elapsed * 1e3 / len(cache):6.3f} ms/symbol"
+    )
+
+
+def main() -> None:
+    inputs = [fake_rows(i) for i in range(SYMBOLS)]
+    measure("Candles", build_candles, inputs)
+    try:
+        import pandas  # noqa: F401
+    except ImportError:
+        print("pandas not installed, skipping DataFrame baseline")
+        return
+    measure("DataFrame", build_dataframe, inputs)
+
+
+if __name__ == "__main__":
+    main()
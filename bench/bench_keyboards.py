@@ -0,0 +1,33 @@
+# Per-call cost of producing and serializing reply markups, rebuilding each
+# time (the old behaviour, via .build) versus the cached markups.
+# Run from the repo root: python -m bench.bench_keyboards
+import timeit
+
+from bot import keyboards as kb
+
+CASES = [
+    ("kb_main", kb.kb_main, ()),
+    ("kb_access", kb.kb_access, ()),
+    ("kb_coins_menu", kb.kb_coins_menu, ()),
+    ("kb_chart_tf", kb.kb_chart_tf, ()),
+    ("kb_journal", kb.kb_journal, ()),
+    ("kb_symbol_actions", kb.kb_symbol_actions, ("BTC/USDT", False)),
+    ("kb_ticket_admin", kb.kb_ticket_admin, (42,)),
+]
+
+
+def per_call_us(fn, args, n: int) -> float:
+    # model_dump is what the aiogram session does to the markup before sending.
+    return timeit.timeit(lambda: fn(*args).model_dump(exclude_none=True), number=n) / n * 1e6
+
+
+def main(n: int = 5000) -> None:
+    print(f"{'keyboard':<20}{'rebuild us':>12}{'cached us':>12}{'speedup':>10}")
+    for name, fn, args in CASES:
+        before = per_call_us(fn.build, args, n)
+        after = per_call_us(fn, args, n)
+        print(f"{name:<20}{before:>12.1f}{after:>12.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
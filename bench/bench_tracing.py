@@ -0,0 +1,37 @@
+# Overhead of a traced call outside any trace (tracing off or update not
+# sampled) and inside a sampled trace, against the bare function.
+# Run from the repo root: python -m bench.bench_tracing
+import asyncio
+import time
+
+from bot import tracing
+
+
+async def work():
+    return None
+
+
+traced_work = tracing.traced("bench.work")(work)
+
+
+async def per_call_ns(fn, n: int) -> float:
+    t0 = time.perf_counter_ns()
+    for _ in range(n):
+        await fn()
+    return (time.perf_counter_ns() - t0) / n
+
+
+async def main(n: int = 200000) -> None:
+    bare = await per_call_ns(work, n)
+    off = await per_call_ns(traced_work, n)
+    root = tracing.Span("bench", None, "bench", {}, [])
+    token = tracing._current.set(root)
+    on = await per_call_ns(traced_work, n // 10)
+    tracing._current.reset(token)
+    print(f"bare        {bare:8.0f} ns/call")
+    print(f"traced off  {off:8.0f} ns/call (+{off - bare:.0f})")
+    print(f"traced on   {on:8.0f} ns/call (+{on - bare:.0f})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from aiogram import BaseMiddleware
+
+from . import db
+
+# Admin analytics from daily rollups. Events are counted in memory and added
+# to daily_stats on each flush, so handlers never write to the database for
+# analytics and the dashboard reads a few hundred rollup rows at most.
+# Counts buffered since the last flush are lost if the process crashes;
+# payments and users remain the source of truth.
+
+
+class Analytics:
+    def __init__(self, db_path: str, tz: str):
+        self.db_path = db_path
+        self.tz = ZoneInfo(tz)
+        self._counts: Counter = Counter()
+        self._seen: set[int] = set()
+        # name -> (object, {key: attribute}); hit counters read as deltas.
+        self._caches: dict[str, tuple[object, dict[str, str]]] = {}
+        self._last: dict[tuple[str, str], int] = {}
+
+    def day(self, offset: int = 0) -> str:
+        return (datetime.now(self.tz).date() - timedelta(days=offset)).isoformat()
+
+    def hit(self, metric: str, key: str = "", n: int = 1) -> None:
+        self._counts[(metric, key)] += n
+
+    def seen(self, user_id: int) -> None:
+        self._seen.add(user_id)
+
+    def watch_cache(self, name: str, obj, **keys: str) -> None:
+        self._caches[name] = (obj, keys)
+
+    async def flush(self) -> None:
+        for name, (obj, keys) in self._caches.items():
+            for key, attr in keys.items():
+                value = getattr(obj, attr)
+                prev = self._last.get((name, key), 0)
+                if value > prev:
+                    self._counts[("cache", f"{name}:{key}")] += value - prev
+                self._last[(name, key)] = value
+        counts, self._counts = self._counts, Counter()
+        seen, self._seen = self._seen, set()
+        if not counts and not seen:
+            return
+        try:
+            await db.add_daily_stats(self.db_path, self.day(), counts, seen)
+        except Exception as e:
+            # Keep the counts for the next attempt.
+            self._counts.update(counts)
+            self._seen |= seen
+            print(f"[analytics] flush failed: {e}")
+
+    async def snapshot(self) -> None:
+        # Gauges that aren't events; taken by the lease holder only.
+        await db.set_daily_gauge(self.db_path, self.day(), "active_paid", await db.count_active_paid(self.db_path))
+        await db.purge_daily_active(self.db_path, self.day(35))
+
+
+class AnalyticsMiddleware(BaseMiddleware):
+    # Inner middleware: runs only for updates that matched a handler.
+    def __init__(self, analytics: Analytics):
+        self.analytics = analytics
+
+    async def __call__(self, handler, event, data: dict):
+        user = data.get("event_from_user")
+        if user is not None:
+            self.analytics.seen(user.id)
+        h = data.get("handler")
+        if h is not None:
+            self.analytics.hit("handler", getattr(h.callback, "__name__", "?"))
+        return await handler(event, data)
+
+
+def _pct(part: int, total: int) -> str:
+    return f"{part / total * 100:.0f}%" if total else "—"
+
+
+def format_dashboard(rows: list[tuple[str, str, str, int]], today: str, days: int = 7) -> str:
+    # rows: (day, metric, key, value) for the last `days` days.
+    today_v: Counter = Counter()
+    period: Counter = Counter()
+    active_paid = None
+    for day, metric, key, value in sorted(rows):
+        if metric == "active_paid":
+            active_paid = value
+            continue
+        period[(metric, key)] += value
+        if day == today:
+            today_v[(metric, key)] += value
+
+    def top(metric: str, n: int = 5) -> str:
+        items = sorted(((v, k) for (m, k), v in period.items() if m == metric), reverse=True)[:n]
+        return ", ".join(f"{k} {v}" for v, k in items) or "—"
+
+    fresh, stale, miss = (period[("cache", f"market:{k}")] for k in ("fresh", "stale", "miss"))
+    a_hit, a_miss = period[("cache", "access:hit")], period[("cache", "access:miss")]
+    return (
+        f"📊 Статистика (сегодня / {days} дн.)\n\n"
+        f"DAU: {today_v[('dau', '')]} / ср. {period[('dau', '')] / days:.0f}\n"
+        f"Новые пользователи: {today_v[('signups', '')]} / {period[('signups', '')]}\n"
+        f"Оплаты: {today_v[('payments', '')]} / {period[('payments', '')]}\n"
+        f"Stars: {today_v[('stars', '')]} / {period[('stars', '')]} ⭐\n"
+        f"Активных платных: {active_paid if active_paid is not None else '—'}\n\n"
+        f"Символы: {top('symbol')}\n"
+        f"Таймфреймы: {top('timeframe')}\n"
+        f"Разделы: {top('handler')}\n\n"
+        f"Кэш биржи: fresh {_pct(fresh, fresh + stale + miss)}, stale {_pct(stale, fresh + stale + miss)}\n"
+        f"Кэш доступа: {_pct(a_hit, a_hit + a_miss)}"
+    )
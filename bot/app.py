@@ -1,19 +1,29 @@
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery
+from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery, FSInputFile, BufferedInputFile, ChatMemberUpdated
 from aiogram.filters import CommandStart, Command
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from aiogram.utils.markdown import hbold, hcode
 
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-import aiosqlite
+import asyncio
+
+import numpy as np
+import html
+import os
 import secrets
+import tempfile
 
-from .config import load_config
+from .config import Config, load_config
 from . import db
+from .jobs import run_periodic, start_jobs
+from .sendqueue import SendQueue, GLOBAL_RATE
+from .tracing import Tracer, TracingMiddleware, TracingSessionMiddleware
+from .coord import CoordStorage, InvalidationBus, LocalCache, Lease, SharedRateLimiter, make_backend
+from .invites import InviteLinkPool
 from .keyboards import (
     kb_main,
     kb_access,
@@ -24,10 +34,18 @@ from .keyboards import (
     kb_chart_tf,
     kb_symbol_actions,
     kb_journal,
+    kb_journal_page,
+    kb_journal_stats,
+    kb_tickets_page,
 )
-from .charts import fetch_ohlcv, add_ma30, detect_regime, render_png
-from .coins import top_movers
-from .texts import DECISION_BRIEF, PROMO_TEXT, TILT_TEXT, CHECKLIST_PRE, CHECKLIST_POST, DISCLAIMER
+from .charts import add_ma30, detect_regime, render_equity, render_png
+from .coins import pick_movers
+from .market import MarketData, MarketUnavailable, UnknownSymbol
+from .backtest import run_backtest, format_result, TIMEFRAMES as BACKTEST_TIMEFRAMES
+from .trades import format_stats
+from .analytics import Analytics, AnalyticsMiddleware, format_dashboard
+from .digest import parse_digest_time, fmt_minute
+from .texts import DECISION_BRIEF, PROMO_TEXT, TILT_TEXT, CHECKLIST_PRE, CHECKLIST_POST, DISCLAIMER, fmt_ts
 
 
 class SupportStates(StatesGroup):
@@ -47,10 +65,23 @@ class CoinsStates(StatesGroup):
 
 class JournalStates(StatesGroup):
     awaiting_journal_text = State()
+    awaiting_journal_search = State()
+
 
+JOURNAL_PAGE_SIZE = 8
+# Keeps a full page under Telegram's 4096-character message limit.
+JOURNAL_ENTRY_MAX = 450
+JOURNAL_QUERY_ECHO_MAX = 64
+TICKETS_PAGE_SIZE = 10
+TICKET_MESSAGE_MAX = 250
+# Characters of history in one ticket view; the oldest messages that don't
+# fit are left out, so the view stays under 4096 whatever the history.
+TICKET_VIEW_BUDGET = 3500
 
-async def ensure_access(cfg, cq: CallbackQuery) -> bool:
-    ok = await db.is_access_active(cfg.db_path, cq.from_user.id)
+
+async def ensure_access(cfg, access: LocalCache, cq: CallbackQuery) -> bool:
+    uid = cq.from_user.id
+    ok = await access.get_or_load(uid, lambda: db.is_access_active(cfg.db_path, uid))
     if ok:
         return True
     await cq.answer()
@@ -58,35 +89,103 @@ async def ensure_access(cfg, cq: CallbackQuery) -> bool:
     return False
 
 
+def render_journal(title: str, items: list[tuple[int, str, str]]) -> str:
+    parts = []
+    for _, ts, t in items:
+        if len(t) > JOURNAL_ENTRY_MAX:
+            t = t[: JOURNAL_ENTRY_MAX - 1] + "…"
+        parts.append(f"{hcode(ts[:19])}\n{html.escape(t, quote=False)}")
+    return title + "\n\n" + "\n\n".join(parts)
+
+
+EXCHANGE_DOWN = "⚠️ Биржа сейчас не отвечает, попробуй через минуту."
+
+
+def stale_note(res) -> str:
+    if not res.stale:
+        return ""
+    return f"\n⚠️ Данные устарели на {max(1, int(res.age // 60))} мин — биржа не отвечает, обновляю."
+
+
 def mk_payload(user_id: int) -> str:
     return f"access30d:{user_id}:{int(datetime.now(timezone.utc).timestamp())}:{secrets.token_hex(4)}"
 
 
-async def run():
-    cfg = load_config()
-    await db.init_db(cfg.db_path)
-
+@dataclass
+class App:
+    bot: Bot
+    dp: Dispatcher
+    sendq: SendQueue
+    analytics: Analytics
+    tracer: Tracer
+    tasks: list[asyncio.Task] = field(default_factory=list)
+
+    async def close(self) -> None:
+        for t in self.tasks:
+            t.cancel()
+        await self.sendq.stop()
+        await self.analytics.flush()
+        await self.bot.session.close()
+        await asyncio.to_thread(self.tracer.close)
+
+
+async def build(cfg: Config, coord, worker_id: str = "main") -> App:
+    # Everything one bot process needs. State that must agree across worker
+    # processes (FSM, access cache invalidation, send rate, singleton jobs)
+    # goes through the coordination backend.
     bot = Bot(cfg.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=CoordStorage(coord))
+    bus = InvalidationBus(coord)
+    access = LocalCache(bus, "access", ttl=60)
+    tracer = Tracer(cfg.trace_file, cfg.trace_sample, cfg.trace_slow_ms)
+    if tracer.enabled:
+        dp.update.outer_middleware(TracingMiddleware(tracer))
+        bot.session.middleware(TracingSessionMiddleware())
 
     me = await bot.get_me()
     print(
         f"[startup] bot_id={me.id} admin_user_id={cfg.admin_user_id} "
         f"support_group_id={cfg.support_group_id} private_channel_id={cfg.private_channel_id}"
     )
+    invites = None
     if cfg.private_channel_id:
+        private_chat_type = None
         try:
             private_chat = await bot.get_chat(int(cfg.private_channel_id))
+            private_chat_type = private_chat.type
             print(
                 f"[startup] private_chat_ok id={private_chat.id} "
                 f"type={private_chat.type} title={getattr(private_chat, 'title', None)}"
             )
         except Exception as e:
             print(f"[startup] private_chat_check_failed id={cfg.private_channel_id} error={e}")
+        invites = InviteLinkPool(
+            bot, cfg.db_path, int(cfg.private_channel_id), private_chat_type, cfg.invite_pool_size
+        )
+    support_is_forum = False
+    try:
+        support_chat = await bot.get_chat(cfg.support_group_id)
+        support_is_forum = bool(getattr(support_chat, "is_forum", False))
+        print(f"[startup] support_chat_ok id={support_chat.id} is_forum={support_is_forum}")
+    except Exception as e:
+        print(f"[startup] support_chat_check_failed id={cfg.support_group_id} error={e}")
+
+    sendq = SendQueue(bot, limiter=SharedRateLimiter(coord, "tg:send", GLOBAL_RATE))
+    sendq.start()
+    market = MarketData()
+    analytics = Analytics(cfg.db_path, cfg.tz)
+    analytics.watch_cache("market", market, fresh="hits", stale="stale_hits", miss="misses")
+    analytics.watch_cache("access", access, hit="hits", miss="misses")
+    dp.message.middleware(AnalyticsMiddleware(analytics))
+    dp.callback_query.middleware(AnalyticsMiddleware(analytics))
+
+    async def touch_user(user) -> None:
+        if await db.upsert_user(cfg.db_path, user.id, user.username):
+            analytics.hit("signups")
 
     @dp.message(CommandStart())
     async def start(m: Message):
-        await db.upsert_user(cfg.db_path, m.from_user.id, m.from_user.username)
+        await touch_user(m.from_user)
         await m.answer("🏠 Главное меню\n\n⚠️ Не финсовет.", reply_markup=kb_main())
 
     @dp.message(Command("admin"))
@@ -95,6 +194,24 @@ async def run():
             return
         await m.answer("🛠 Админ-панель", reply_markup=kb_admin_panel())
 
+    async def admin_stats_text() -> str:
+        await analytics.flush()
+        rows = await db.daily_stats_since(cfg.db_path, analytics.day(6))
+        return format_dashboard(rows, analytics.day())
+
+    @dp.message(Command("stats"))
+    async def admin_stats_cmd(m: Message):
+        if m.from_user.id != cfg.admin_user_id:
+            return
+        await m.answer(await admin_stats_text())
+
+    @dp.callback_query(F.data == "admin:stats")
+    async def admin_stats(cq: CallbackQuery):
+        if cq.from_user.id != cfg.admin_user_id:
+            return await cq.answer("Not allowed")
+        await cq.answer()
+        await cq.message.edit_text(await admin_stats_text(), reply_markup=kb_admin_panel())
+
     @dp.message(Command("getchatid"))
     async def getchatid(m: Message):
         await m.answer(f"chat_id = {hcode(str(m.chat.id))}")
@@ -117,6 +234,8 @@ async def run():
                 )
             except Exception as e:
                 lines.append(f"private_chat_error={hcode(str(e))}")
+        scans = await db.explain_hot_queries(cfg.db_path)
+        lines.append(f"hot_queries={hcode('indexed' if not scans else ', '.join(scans))}")
         await m.answer("\n".join(lines))
 
     @dp.callback_query(F.data == "nav:back:main")
@@ -127,7 +246,7 @@ async def run():
     # ===== Access / Stars =====
     @dp.callback_query(F.data == "main:access")
     async def access_main(cq: CallbackQuery):
-        await db.upsert_user(cfg.db_path, cq.from_user.id, cq.from_user.username)
+        await touch_user(cq.from_user)
         await cq.answer()
         await cq.message.edit_text("⭐ Доступ", reply_markup=kb_access())
 
@@ -151,13 +270,13 @@ async def run():
         if u.get("is_whitelisted") == 1:
             txt += "Режим: FREE (whitelist)\n"
         else:
-            txt += f"access_until: {hcode(str(u.get('access_until')))}\n"
+            txt += f"access_until: {hcode(fmt_ts(u.get('access_until'), cfg.tz))}\n"
         txt += f"active_symbol: {hcode(str(u.get('active_symbol')))}"
         await cq.message.edit_text(txt, reply_markup=kb_access())
 
     @dp.callback_query(F.data == "access:buy:30d")
     async def access_buy(cq: CallbackQuery):
-        await db.upsert_user(cfg.db_path, cq.from_user.id, cq.from_user.username)
+        await touch_user(cq.from_user)
         await cq.answer()
         u = await db.get_user(cfg.db_path, cq.from_user.id) or {}
         if not u.get("accepted_disclaimer_at"):
@@ -181,6 +300,16 @@ async def run():
 
     @dp.pre_checkout_query()
     async def pre_checkout(pre: PreCheckoutQuery):
+        p = await db.get_payment(cfg.db_path, pre.invoice_payload)
+        if (
+            not p
+            or p.get("status") != "pending"
+            or int(p["user_id"]) != pre.from_user.id
+            or int(p["stars_amount"]) != int(pre.total_amount)
+        ):
+            return await bot.answer_pre_checkout_query(
+                pre.id, ok=False, error_message="Инвойс устарел. Создай новый в ⭐ Доступ."
+            )
         await bot.answer_pre_checkout_query(pre.id, ok=True)
 
     @dp.message(F.successful_payment)
@@ -189,51 +318,61 @@ async def run():
         if sp.currency != "XTR":
             return
         payload = sp.invoice_payload
-        p = await db.get_payment(cfg.db_path, payload)
-        if not p or p.get("status") == "paid":
+        result = await db.apply_payment(
+            cfg.db_path, payload, m.from_user.id, int(sp.total_amount), sp.telegram_payment_charge_id
+        )
+        if result == "duplicate":
             return
-        expected = int(p["stars_amount"])
-        if int(sp.total_amount) != expected:
+        if result == "ok":
+            await access.invalidate(m.from_user.id)
+            analytics.hit("payments")
+            analytics.hit("stars", n=int(sp.total_amount))
+            await analytics.flush()
+        else:
             await bot.send_message(
                 cfg.support_group_id,
-                f"⚠️ Payment amount mismatch payload={payload} got={sp.total_amount} expected={expected}",
+                f"⚠️ Payment {result} payload={payload} user_id={m.from_user.id} "
+                f"got={sp.total_amount} charge_id={sp.telegram_payment_charge_id}",
             )
             return
-        await db.mark_payment_paid(cfg.db_path, payload)
-        await db.grant_access_30d(cfg.db_path, m.from_user.id)
-        await m.answer("✅ Оплата получена. Доступ активен на 30 дней.", reply_markup=kb_main())
+        await m.answer("✅ Оплата получена. Доступ продлён на 30 дней.", reply_markup=kb_main())
 
     # Help
     @dp.callback_query(F.data == "main:help")
     async def help_(cq: CallbackQuery):
         await cq.answer()
-        await cq.message.answer("ℹ️ Помощь\n\n— /getchatid\n— /admin (админ)\n\n⚠️ Не финсовет.", reply_markup=kb_main())
+        await cq.message.answer("ℹ️ Помощь\n\n— /getchatid\n— /jsearch — поиск по журналу\n— /backtest [SYMBOL] [TF] [DAYS] — статистика режимов\n— /digest HH:MM | off — ежедневный дайджест\n— /admin (админ)\n\n⚠️ Не финсовет.", reply_markup=kb_main())
 
     # Coins
     @dp.callback_query(F.data == "main:coins")
     async def coins(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await cq.message.edit_text("🪙 Монеты", reply_markup=kb_coins_menu())
 
     @dp.callback_query(F.data.in_({"coins:gainers", "coins:losers"}))
     async def coins_movers(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer("Считаю...")
         direction = "gainers" if cq.data.endswith("gainers") else "losers"
-        movers = top_movers(limit=10, direction=direction)
+        try:
+            res = await market.usdt_changes()
+        except MarketUnavailable:
+            return await cq.message.answer(EXCHANGE_DOWN)
+        movers = pick_movers(res.value, limit=10, direction=direction)
         lines = [f"{i+1}) <code>{sym}</code>  {pct:+.2f}%" for i, (sym, pct) in enumerate(movers)]
         await cq.message.answer(
             ("📈 Топ рост\n" if direction == "gainers" else "📉 Топ падение\n")
             + "\n".join(lines)
+            + stale_note(res)
             + "\n\n🔎 Поиск → выбрать монету"
         )
 
     @dp.callback_query(F.data == "coins:favorites")
     async def coins_favorites(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         favs = await db.list_favorites(cfg.db_path, cq.from_user.id, 30)
@@ -244,7 +383,7 @@ async def run():
 
     @dp.callback_query(F.data == "coins:search")
     async def coins_search(cq: CallbackQuery, state: FSMContext):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await state.set_state(CoinsStates.awaiting_symbol_search)
@@ -254,7 +393,7 @@ async def run():
     async def coins_search_take(m: Message, state: FSMContext):
         symbol = m.text.strip().upper().replace("_", "/")
         await state.clear()
-        await db.upsert_user(cfg.db_path, m.from_user.id, m.from_user.username)
+        await touch_user(m.from_user)
         await db.set_active_symbol(cfg.db_path, m.from_user.id, symbol)
         favs = await db.list_favorites(cfg.db_path, m.from_user.id, 200)
         is_fav = symbol in favs
@@ -262,7 +401,7 @@ async def run():
 
     @dp.callback_query(F.data.startswith("coins:set:"))
     async def coins_set(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         symbol = cq.data.split(":", 2)[2]
         await cq.answer("OK")
@@ -275,7 +414,7 @@ async def run():
 
     @dp.callback_query(F.data.startswith("coins:fav:"))
     async def coins_fav(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         _, _, action, symbol = cq.data.split(":", 3)
         await cq.answer()
@@ -289,56 +428,124 @@ async def run():
     # Regime/Charts
     @dp.callback_query(F.data == "main:regime")
     async def regime(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await cq.message.edit_text("📊 Выбери TF", reply_markup=kb_chart_tf())
 
     @dp.callback_query(F.data.startswith("chart:tf:"))
     async def chart(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         tf = cq.data.split(":")[-1]
         await cq.answer("График...")
         u = await db.get_user(cfg.db_path, cq.from_user.id) or {}
         symbol = u.get("active_symbol") or "RAVE/USDT"
+        analytics.hit("symbol", symbol)
+        analytics.hit("timeframe", tf)
+        try:
+            res = await market.ohlcv(symbol, tf)
+        except UnknownSymbol:
+            return await cq.message.answer(
+                f"❓ Биржа не знает пару <code>{html.escape(symbol)}</code>. Выбери монету в 🪙 Монеты.",
+                reply_markup=kb_chart_tf(),
+            )
+        except MarketUnavailable:
+            return await cq.message.answer(EXCHANGE_DOWN, reply_markup=kb_chart_tf())
         try:
-            df = add_ma30(fetch_ohlcv(symbol, tf))
-            reg = detect_regime(df)
-            png = render_png(df, f"{symbol} • {tf} • MA30 • {reg}")
+            candles = add_ma30(res.value)
+            reg = detect_regime(candles)
+            png = render_png(candles, f"{symbol} • {tf} • MA30 • {reg}")
         except Exception as e:
-            return await cq.message.answer(f"❌ Ошибка: <code>{str(e)[:200]}</code>")
+            return await cq.message.answer(f"❌ Ошибка: <code>{html.escape(str(e)[:200])}</code>")
         await cq.message.answer_photo(
-            photo=png,
-            caption=f"{hbold(symbol)} • {hcode(tf)}\nРежим: {hbold(reg)}\n\n{DECISION_BRIEF}",
+            photo=BufferedInputFile(png, "chart.png"),
+            caption=f"{hbold(symbol)} • {hcode(tf)}\nРежим: {hbold(reg)}{stale_note(res)}\n\n{DECISION_BRIEF}",
             reply_markup=kb_chart_tf(),
         )
 
+    @dp.message(Command("digest"))
+    async def digest_cmd(m: Message):
+        await touch_user(m.from_user)
+        arg = (m.text or "").partition(" ")[2].strip().lower()
+        if not arg:
+            u = await db.get_user(cfg.db_path, m.from_user.id) or {}
+            minute = u.get("digest_minute")
+            state = f"в {hcode(fmt_minute(minute))} ({cfg.tz})" if minute is not None else "выключен"
+            return await m.answer(
+                f"☀️ Дайджест {state}.\n\nФормат: <code>/digest 08:30</code> или <code>/digest off</code>"
+            )
+        if arg == "off":
+            await db.set_digest_time(cfg.db_path, m.from_user.id, None)
+            return await m.answer("☀️ Дайджест выключен.")
+        try:
+            minute = parse_digest_time(arg)
+        except ValueError:
+            return await m.answer("Формат: <code>/digest 08:30</code> или <code>/digest off</code>")
+        await db.set_digest_time(cfg.db_path, m.from_user.id, minute)
+        await m.answer(
+            f"☀️ Дайджест по избранному каждый день в {hcode(fmt_minute(minute))} ({cfg.tz})."
+            + ("" if await db.is_access_active(cfg.db_path, m.from_user.id) else "\nПриходит при активном доступе.")
+        )
+
+    @dp.message(Command("backtest"))
+    async def backtest(m: Message):
+        if not await db.is_access_active(cfg.db_path, m.from_user.id):
+            return await m.answer("Доступ не активен. Открой ⭐ Доступ.", reply_markup=kb_access())
+        args = (m.text or "").split()[1:]
+        u = await db.get_user(cfg.db_path, m.from_user.id) or {}
+        symbol = u.get("active_symbol") or "RAVE/USDT"
+        tf, days = "15m", 365
+        try:
+            for a in args:
+                if "/" in a or "_" in a:
+                    symbol = a.upper().replace("_", "/")
+                elif a in BACKTEST_TIMEFRAMES:
+                    tf = a
+                else:
+                    days = int(a)
+        except ValueError:
+            return await m.answer(
+                "Формат: <code>/backtest [SYMBOL] [TF] [DAYS]</code>, напр. <code>/backtest BTC/USDT 15m 365</code>"
+            )
+        # Forward horizon of ~4 hours, at least one bar.
+        horizon = max(1, 4 * 3600 // BACKTEST_TIMEFRAMES[tf])
+        wait = await m.answer(f"⏳ Backtest {hcode(symbol)} • {hcode(tf)} • {days}d...")
+        try:
+            r = await run_backtest(cfg.db_path, symbol, tf, days, horizon)
+        except Exception as e:
+            return await wait.edit_text(f"❌ Ошибка: <code>{html.escape(str(e)[:200])}</code>")
+        await wait.edit_text(
+            f"📈 {hbold(symbol)} • {hcode(tf)} • {days}d • {r['bars']} баров\n"
+            f"Доходность через {horizon} баров по режиму на закрытии бара:\n"
+            f"<pre>{format_result(r)}</pre>\n\n⚠️ Прошлое не гарантирует будущее."
+        )
+
     # Guides
     @dp.callback_query(F.data == "main:promo")
     async def promo(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await cq.message.answer(PROMO_TEXT)
 
     @dp.callback_query(F.data == "main:tilt")
     async def tilt(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await cq.message.answer(TILT_TEXT)
 
     @dp.callback_query(F.data == "main:checklists")
     async def checklists(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await cq.message.answer(CHECKLIST_PRE + "\n\n" + CHECKLIST_POST)
 
     @dp.callback_query(F.data == "main:strategies")
     async def strategies(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await cq.message.answer("⚙️ Стратегии\n\n" + DECISION_BRIEF)
@@ -346,40 +553,139 @@ async def run():
     # Journal
     @dp.callback_query(F.data == "main:journal")
     async def journal(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await cq.message.edit_text("🧾 Журнал", reply_markup=kb_journal())
 
     @dp.callback_query(F.data == "journal:add")
     async def journal_add(cq: CallbackQuery, state: FSMContext):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await state.set_state(JournalStates.awaiting_journal_text)
-        await cq.message.answer("Напиши запись (1 сообщение).")
+        await cq.message.answer(
+            "Напиши запись (1 сообщение).\n\n"
+            "Сделка попадёт в статистику, если указаны монета, сторона и цены:\n"
+            "<code>BTC long 65000 -> 66200 sl 64000 #trend</code>"
+        )
 
     @dp.message(JournalStates.awaiting_journal_text, F.text)
     async def journal_take(m: Message, state: FSMContext):
         await state.clear()
-        await db.add_journal(cfg.db_path, m.from_user.id, m.text.strip())
-        await m.answer("✅ Запись добавлена", reply_markup=kb_main())
+        trade = await db.add_journal(cfg.db_path, m.from_user.id, m.text.strip())
+        note = f"\n📈 Сделка: {hcode(trade.summary())}" if trade else ""
+        await m.answer(f"✅ Запись добавлена{note}", reply_markup=kb_main())
+
+    @dp.callback_query(F.data == "journal:stats")
+    async def journal_stats(cq: CallbackQuery):
+        if not await ensure_access(cfg, access, cq):
+            return
+        await cq.answer()
+        rows = await db.trade_stats(cfg.db_path, cq.from_user.id)
+        await cq.message.edit_text(format_stats(rows), reply_markup=kb_journal_stats())
+
+    @dp.callback_query(F.data == "journal:equity")
+    async def journal_equity(cq: CallbackQuery):
+        if not await ensure_access(cfg, access, cq):
+            return
+        points = await db.equity_points(cfg.db_path, cq.from_user.id)
+        if len(points) < 2:
+            return await cq.answer("Нужно хотя бы 2 сделки", show_alert=True)
+        await cq.answer("Рисую...")
+        ts = np.array([p[0][:19] for p in points], dtype="datetime64[s]")
+        equity = np.cumsum([p[1] for p in points])
+        png = render_equity(ts, equity, f"Equity • {len(points)} trades • Σ {equity[-1]:+.1f}%")
+        await cq.message.answer_photo(photo=BufferedInputFile(png, "equity.png"))
+
+    async def send_journal_page(cq: CallbackQuery, before_id: int | None = None, after_id: int | None = None, edit: bool = False):
+        items, has_older, has_newer = await db.journal_page(
+            cfg.db_path, cq.from_user.id, before_id=before_id, after_id=after_id, limit=JOURNAL_PAGE_SIZE
+        )
+        if not items:
+            return await cq.message.answer("Пусто")
+        txt = render_journal("🗂 Записи:", items)
+        kb = kb_journal_page(items[-1][0] if has_older else None, items[0][0] if has_newer else None)
+        if edit:
+            await cq.message.edit_text(txt, reply_markup=kb)
+        else:
+            await cq.message.answer(txt, reply_markup=kb)
 
     @dp.callback_query(F.data == "journal:list")
     async def journal_list(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
+            return
+        await cq.answer()
+        await send_journal_page(cq)
+
+    @dp.callback_query(F.data.startswith("journal:page:"))
+    async def journal_page(cq: CallbackQuery):
+        if not await ensure_access(cfg, access, cq):
             return
+        _, _, direction, anchor = cq.data.split(":", 3)
         await cq.answer()
-        items = await db.list_journal(cfg.db_path, cq.from_user.id, 20)
+        if direction == "older":
+            await send_journal_page(cq, before_id=int(anchor), edit=True)
+        else:
+            await send_journal_page(cq, after_id=int(anchor), edit=True)
+
+    async def answer_journal_search(m: Message, query: str):
+        items = await db.search_journal(cfg.db_path, m.from_user.id, query, JOURNAL_PAGE_SIZE)
         if not items:
-            return await cq.message.answer("Пусто")
-        txt = "🗂 Последние записи:\n\n" + "\n\n".join([f"{hcode(ts[:19])}\n{t}" for ts, t in items])
-        await cq.message.answer(txt)
+            return await m.answer("Ничего не найдено", reply_markup=kb_journal())
+        if len(query) > JOURNAL_QUERY_ECHO_MAX:
+            query = query[: JOURNAL_QUERY_ECHO_MAX - 1] + "…"
+        await m.answer(render_journal(f"🔎 {html.escape(query, quote=False)}:", items), reply_markup=kb_journal())
+
+    @dp.callback_query(F.data == "journal:search")
+    async def journal_search(cq: CallbackQuery, state: FSMContext):
+        if not await ensure_access(cfg, access, cq):
+            return
+        await cq.answer()
+        await state.set_state(JournalStates.awaiting_journal_search)
+        await cq.message.answer("Что искать в журнале? (или /jsearch слова)")
+
+    @dp.message(JournalStates.awaiting_journal_search, F.text)
+    async def journal_search_take(m: Message, state: FSMContext):
+        await state.clear()
+        await answer_journal_search(m, m.text.strip())
+
+    @dp.message(Command("jsearch"))
+    async def jsearch(m: Message):
+        if not await db.is_access_active(cfg.db_path, m.from_user.id):
+            return await m.answer("Доступ не активен. Открой ⭐ Доступ.", reply_markup=kb_access())
+        query = (m.text or "").partition(" ")[2].strip()
+        if not query:
+            return await m.answer("Формат: <code>/jsearch слова</code>")
+        await answer_journal_search(m, query)
+
+    @dp.callback_query(F.data == "journal:export")
+    async def journal_export(cq: CallbackQuery):
+        if not await ensure_access(cfg, access, cq):
+            return
+        await cq.answer("Готовлю файл...")
+        # Rows are streamed from the cursor to a temp file, so export size
+        # doesn't depend on memory.
+        fd, path = tempfile.mkstemp(prefix="journal_", suffix=".txt")
+        try:
+            n = 0
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                async for ts, t in db.iter_journal(cfg.db_path, cq.from_user.id):
+                    f.write(f"[{ts[:19]}]\n{t}\n\n")
+                    n += 1
+            if not n:
+                return await cq.message.answer("Пусто")
+            await cq.message.answer_document(
+                FSInputFile(path, filename=f"journal_{cq.from_user.id}.txt"),
+                caption=f"🧾 Записей: {n}",
+            )
+        finally:
+            os.unlink(path)
 
     # Privatka
     @dp.callback_query(F.data == "main:privatka")
     async def privatka(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         if not cfg.private_channel_id:
@@ -387,34 +693,36 @@ async def run():
 
         channel_id = int(cfg.private_channel_id)
         try:
-            chat = await bot.get_chat(channel_id)
-            # member_limit supported for supergroup, but not for channel chats
-            if chat.type == "supergroup":
-                link = await bot.create_chat_invite_link(chat_id=channel_id, member_limit=1)
-                await cq.message.answer(f"🔒 Приватка — одноразовая ссылка:\n{link.invite_link}")
-            else:
-                link = await bot.create_chat_invite_link(chat_id=channel_id)
-                await cq.message.answer(
-                    "🔒 Приватка — ссылка в канал (для каналов Telegram не поддерживает one-time member_limit):"
-                    f"\n{link.invite_link}"
-                )
+            link = await invites.issue(cq.from_user.id)
         except Exception as e:
-            await cq.message.answer(
+            return await cq.message.answer(
                 "❌ Не смог создать invite-link. "
                 f"chat_id=<code>{channel_id}</code>\n"
                 f"<code>{str(e)[:300]}</code>"
             )
+        if invites.single_use:
+            await cq.message.answer(f"🔒 Приватка — одноразовая ссылка:\n{link}")
+        else:
+            await cq.message.answer(f"🔒 Приватка — персональная ссылка (отключится после входа):\n{link}")
+
+    @dp.chat_member()
+    async def private_member_update(event: ChatMemberUpdated):
+        if invites is None or event.chat.id != invites.chat_id or not event.invite_link:
+            return
+        if event.new_chat_member.status in ("member", "restricted"):
+            await invites.on_join(event.invite_link.invite_link)
+
     # Support
     @dp.callback_query(F.data == "main:support")
     async def support(cq: CallbackQuery):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await cq.message.edit_text("🆘 Поддержка", reply_markup=kb_support())
 
     @dp.callback_query(F.data == "support:new")
     async def support_new(cq: CallbackQuery, state: FSMContext):
-        if not await ensure_access(cfg, cq):
+        if not await ensure_access(cfg, access, cq):
             return
         await cq.answer()
         await state.set_state(SupportStates.waiting_ticket_text)
@@ -423,19 +731,47 @@ async def run():
     @dp.message(SupportStates.waiting_ticket_text, F.text)
     async def support_take(m: Message, state: FSMContext):
         await state.clear()
-        await db.upsert_user(cfg.db_path, m.from_user.id, m.from_user.username)
+        await touch_user(m.from_user)
         ticket_id = await db.create_ticket(cfg.db_path, m.from_user.id, m.text or "")
         await m.answer(f"✅ Тикет <code>#{ticket_id}</code> создан. Мы ответим здесь.")
+        username = f"@{m.from_user.username}" if m.from_user.username else "—"
         txt = (
             f"🆘 <b>Тикет</b> <code>#{ticket_id}</code>\n"
             f"user_id: <code>{m.from_user.id}</code>\n"
-            f"username: @{m.from_user.username if m.from_user.username else '—'}\n\n"
-            f"{m.text or ''}"
+            f"username: {username}\n\n"
+            f"{html.escape(m.text or '', quote=False)}"
         )
+        thread_id = None
+        if support_is_forum:
+            try:
+                topic = await sendq.submit(
+                    cfg.support_group_id,
+                    lambda: bot.create_forum_topic(cfg.support_group_id, name=f"#{ticket_id} {username}"[:128]),
+                )
+                thread_id = topic.message_thread_id
+            except Exception as e:
+                print(f"[support] create_forum_topic failed ticket={ticket_id} error={e}")
         try:
-            await bot.send_message(cfg.support_group_id, txt, reply_markup=kb_ticket_admin(ticket_id))
+            card = await sendq.send_message(
+                cfg.support_group_id, txt, message_thread_id=thread_id, reply_markup=kb_ticket_admin(ticket_id)
+            )
         except Exception:
-            pass
+            card = None
+        if thread_id is not None or card is not None:
+            await db.set_ticket_thread(cfg.db_path, ticket_id, thread_id, card.message_id if card else None)
+
+    async def deliver_admin_reply(m: Message, ticket_id: int, text: str):
+        t = await db.get_ticket(cfg.db_path, ticket_id)
+        if not t:
+            return await m.reply("❌ Тикет не найден")
+        await db.add_ticket_message(cfg.db_path, ticket_id, "admin", text)
+        try:
+            await sendq.send_message(
+                int(t["user_id"]), f"💬 Ответ по тикету <code>#{ticket_id}</code>:\n\n{html.escape(text, quote=False)}"
+            )
+        except Exception as e:
+            return await m.reply(f"❌ Не доставлено: <code>{html.escape(str(e)[:200])}</code>")
+        await m.reply("✅ Отправлено")
 
     # Admin ticket actions from support group
     @dp.callback_query(F.data.startswith("admin:tickets:reply:"))
@@ -455,17 +791,22 @@ async def run():
         data = await state.get_data()
         ticket_id = int(data.get("ticket_id"))
         await state.clear()
+        await deliver_admin_reply(m, ticket_id, m.text)
 
-        async with aiosqlite.connect(cfg.db_path) as dbs:
-            dbs.row_factory = aiosqlite.Row
-            cur = await dbs.execute("SELECT user_id FROM tickets WHERE ticket_id=?", (ticket_id,))
-            row = await cur.fetchone()
-        if not row:
-            return await m.reply("❌ Тикет не найден")
-        user_id = int(row["user_id"])
-        await db.add_ticket_message(cfg.db_path, ticket_id, "admin", m.text)
-        await bot.send_message(user_id, f"💬 Ответ по тикету <code>#{ticket_id}</code>:\n\n{m.text}")
-        await m.reply("✅ Отправлено")
+    # Replying inside a ticket's forum topic, or to its card in a plain group,
+    # answers the ticket directly.
+    @dp.message(F.chat.id == cfg.support_group_id, F.text, ~F.text.startswith("/"))
+    async def support_group_reply(m: Message):
+        if m.from_user.id != cfg.admin_user_id:
+            return
+        t = await db.find_ticket_by_group_message(
+            cfg.db_path,
+            m.message_thread_id if m.is_topic_message else None,
+            m.reply_to_message.message_id if m.reply_to_message else None,
+        )
+        if not t:
+            return
+        await deliver_admin_reply(m, int(t["ticket_id"]), m.text)
 
     @dp.callback_query(F.data.startswith("admin:tickets:close:"))
     async def admin_close_btn(cq: CallbackQuery):
@@ -475,21 +816,71 @@ async def run():
         await db.close_ticket(cfg.db_path, ticket_id)
         await cq.answer("Закрыто")
         await cq.message.reply(f"✅ Тикет <code>#{ticket_id}</code> закрыт")
+        t = await db.get_ticket(cfg.db_path, ticket_id)
+        if t and t.get("thread_id"):
+            # Fire-and-forget: the queue paces it with the group's other sends.
+            sendq.submit(cfg.support_group_id, lambda: bot.close_forum_topic(cfg.support_group_id, int(t["thread_id"])))
 
-    # Admin panel (private chat)
-    @dp.callback_query(F.data == "admin:tickets:open")
-    async def admin_open(cq: CallbackQuery):
+    @dp.callback_query(F.data.startswith("admin:tickets:view:"))
+    async def admin_ticket_view(cq: CallbackQuery):
         if cq.from_user.id != cfg.admin_user_id:
             return await cq.answer("Not allowed")
+        ticket_id = int(cq.data.split(":")[-1])
         await cq.answer()
-        tickets = await db.get_open_tickets(cfg.db_path, 20)
+        t = await db.get_ticket(cfg.db_path, ticket_id)
+        if not t:
+            return await cq.message.answer("❌ Тикет не найден")
+        history = await db.ticket_history(cfg.db_path, ticket_id)
+        lines = []
+        budget = TICKET_VIEW_BUDGET
+        # Newest first, so it's the oldest messages that get dropped.
+        for msg in reversed(history):
+            text = msg["text"] or ""
+            if len(text) > TICKET_MESSAGE_MAX:
+                text = text[: TICKET_MESSAGE_MAX - 1] + "…"
+            # Counted as rendered: the timestamp line and separators add ~25.
+            budget -= len(text) + 25
+            if budget < 0:
+                break
+            who = "🛠" if msg["sender"] == "admin" else "👤"
+            lines.append(f"{who} {hcode(msg['created_at'][:19])}\n{html.escape(text, quote=False)}")
+        if len(lines) < len(history):
+            lines.append(f"… ранние сообщения скрыты: {len(history) - len(lines)}")
+        lines.append(f"📜 Тикет <code>#{ticket_id}</code> • {t['status']} • user_id=<code>{t['user_id']}</code>")
+        await cq.message.answer("\n\n".join(reversed(lines)), reply_markup=kb_ticket_admin(ticket_id))
+
+    # Admin panel (private chat)
+    async def show_open_tickets(cq: CallbackQuery, before_id: int | None = None, edit: bool = False):
+        tickets, has_more = await db.open_tickets_page(cfg.db_path, before_id, TICKETS_PAGE_SIZE)
         if not tickets:
             return await cq.message.answer("Открытых тикетов нет")
+        lines = ["📥 Открытые тикеты:"]
         for t in tickets:
-            await cq.message.answer(
-                f"🆘 <code>#{t['ticket_id']}</code> user_id=<code>{t['user_id']}</code>",
-                reply_markup=kb_ticket_admin(int(t["ticket_id"])),
+            who = f"@{t['username']}" if t["username"] else f"<code>{t['user_id']}</code>"
+            preview = (t["last_text"] or "").replace("\n", " ")[:80]
+            lines.append(
+                f"<code>#{t['ticket_id']}</code> • {who} • {t['n_messages']} сообщ.\n"
+                f"<i>{html.escape(preview, quote=False)}</i>"
             )
+        kb = kb_tickets_page([int(t["ticket_id"]) for t in tickets], int(tickets[-1]["ticket_id"]) if has_more else None)
+        if edit:
+            await cq.message.edit_text("\n\n".join(lines), reply_markup=kb)
+        else:
+            await cq.message.answer("\n\n".join(lines), reply_markup=kb)
+
+    @dp.callback_query(F.data == "admin:tickets:open")
+    async def admin_open(cq: CallbackQuery):
+        if cq.from_user.id != cfg.admin_user_id:
+            return await cq.answer("Not allowed")
+        await cq.answer()
+        await show_open_tickets(cq)
+
+    @dp.callback_query(F.data.startswith("admin:tickets:page:"))
+    async def admin_open_page(cq: CallbackQuery):
+        if cq.from_user.id != cfg.admin_user_id:
+            return await cq.answer("Not allowed")
+        await cq.answer()
+        await show_open_tickets(cq, before_id=int(cq.data.split(":")[-1]), edit=True)
 
     @dp.callback_query(F.data == "admin:broadcast:new")
     async def admin_broadcast_new(cq: CallbackQuery, state: FSMContext):
@@ -504,28 +895,8 @@ async def run():
         if m.from_user.id != cfg.admin_user_id:
             return
         await state.clear()
-        async with aiosqlite.connect(cfg.db_path) as dbs:
-            dbs.row_factory = aiosqlite.Row
-            cur = await dbs.execute("SELECT user_id, is_whitelisted, access_until FROM users")
-            rows = await cur.fetchall()
-        sent = 0
-        for r in rows:
-            uid = int(r["user_id"])
-            active = r["is_whitelisted"] == 1
-            if not active and r["access_until"]:
-                try:
-                    dt = datetime.fromisoformat(r["access_until"].replace("Z", "+00:00"))
-                    active = dt > datetime.now(timezone.utc)
-                except Exception:
-                    active = False
-            if not active:
-                continue
-            try:
-                await bot.send_message(uid, f"📣 {m.text}")
-                sent += 1
-            except Exception:
-                pass
-        await m.reply(f"✅ Разослано: {sent}")
+        job_id = await db.create_broadcast(cfg.db_path, m.text, m.chat.id)
+        await m.reply(f"⏳ Рассылка #{job_id} поставлена в очередь, сообщу по завершении.")
 
     @dp.callback_query(F.data == "admin:whitelist:add")
     async def wl_add(cq: CallbackQuery, state: FSMContext):
@@ -543,6 +914,7 @@ async def run():
         uid = int(m.text.strip())
         await db.upsert_user(cfg.db_path, uid, None)
         await db.set_whitelist(cfg.db_path, uid, True)
+        await access.invalidate(uid)
         await m.reply("✅ Добавлен")
 
     @dp.callback_query(F.data == "admin:whitelist:remove")
@@ -561,6 +933,31 @@ async def run():
         uid = int(m.text.strip())
         await db.upsert_user(cfg.db_path, uid, None)
         await db.set_whitelist(cfg.db_path, uid, False)
+        await access.invalidate(uid)
         await m.reply("✅ Убран")
 
-    await dp.start_polling(bot)
+    lease = Lease(coord, "jobs", worker_id)
+    tasks = start_jobs(cfg, bot, sendq, invites, lease, market, analytics)
+    tasks.append(asyncio.create_task(run_periodic("analytics_flush", 30, analytics.flush)))
+    tasks.append(asyncio.create_task(bus.run()))
+    return App(bot=bot, dp=dp, sendq=sendq, analytics=analytics, tracer=tracer, tasks=tasks)
+
+
+async def run():
+    cfg = load_config()
+    if cfg.webhook_url:
+        from .cluster import serve
+        return await serve(cfg)
+    if cfg.workers > 1:
+        raise SystemExit("WORKERS>1 requires WEBHOOK_URL (updates are sharded by the webhook front)")
+
+    await db.init_db(cfg.db_path)
+    coord = await make_backend(cfg)
+    app = await build(cfg, coord)
+    try:
+        # Switching back from webhook mode: getUpdates is refused while a webhook is set.
+        await app.bot.delete_webhook()
+        await app.dp.start_polling(app.bot)
+    finally:
+        await app.close()
+        await coord.close()
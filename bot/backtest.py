@@ -0,0 +1,183 @@
+import asyncio
+import json
+import multiprocessing
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ccxt
+import numpy as np
+
+from .charts import MA_WINDOW, REGIMES, regime_codes, rolling_mean
+
+TIMEFRAMES = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400, "1d": 86400}
+PAGE_LIMIT = 1000
+MAX_BARS = 200_000
+RESULT_TTL = 6 * 3600
+
+_pool: ProcessPoolExecutor | None = None
+_inflight: dict[str, asyncio.Future] = {}
+
+
+# ----- worker side (runs in a separate process, plain sqlite3) -----
+
+def _fetch_range(ex, con: sqlite3.Connection, symbol: str, tf: str, start_ms: int, end_ms: int) -> None:
+    cursor = start_ms
+    while cursor < end_ms:
+        page = ex.fetch_ohlcv(symbol, timeframe=tf, since=cursor, limit=PAGE_LIMIT)
+        page = [r for r in page if r[0] >= cursor]
+        if not page:
+            # Gate answers a fixed window from `since`; a window before the
+            # listing (or an exchange gap) is empty, so skip it rather than stop.
+            cursor += PAGE_LIMIT * TIMEFRAMES[tf] * 1000
+            continue
+        con.executemany(
+            "INSERT OR REPLACE INTO candles (symbol, timeframe, ts, open, high, low, close, volume) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(symbol, tf, int(r[0]), r[1], r[2], r[3], r[4], r[5]) for r in page],
+        )
+        con.commit()
+        cursor = int(page[-1][0]) + TIMEFRAMES[tf] * 1000
+
+
+def sync_history(db_path: str, symbol: str, tf: str, since_ms: int) -> None:
+    # Only the gaps before the oldest and after the newest cached candle are
+    # fetched; the newest one is refetched because it may still be forming.
+    now_ms = int(time.time() * 1000)
+    ex = ccxt.gateio({"enableRateLimit": True})
+    con = sqlite3.connect(db_path, timeout=30)
+    try:
+        lo, hi = con.execute(
+            "SELECT MIN(ts), MAX(ts) FROM candles WHERE symbol=? AND timeframe=?", (symbol, tf)
+        ).fetchone()
+        if lo is None:
+            _fetch_range(ex, con, symbol, tf, since_ms, now_ms)
+            return
+        if lo > since_ms:
+            _fetch_range(ex, con, symbol, tf, since_ms, lo)
+        _fetch_range(ex, con, symbol, tf, hi, now_ms)
+    finally:
+        con.close()
+
+
+def load_closes(db_path: str, symbol: str, tf: str, since_ms: int) -> np.ndarray:
+    con = sqlite3.connect(db_path, timeout=30)
+    try:
+        cur = con.execute(
+            "SELECT close FROM candles WHERE symbol=? AND timeframe=? AND ts>=? ORDER BY ts",
+            (symbol, tf, since_ms),
+        )
+        return np.fromiter((r[0] for r in cur), dtype=np.float64)
+    finally:
+        con.close()
+
+
+def regime_stats(close: np.ndarray, horizon: int) -> dict:
+    ma = rolling_mean(close, MA_WINDOW)
+    codes = regime_codes(close, ma)
+    fwd = close[horizon:] / close[:-horizon] - 1.0
+    codes = codes[:-horizon]
+    labelled = codes != 0
+    total = int(labelled.sum())
+    out = {}
+    for code, name in enumerate(REGIMES):
+        if code == 0:
+            continue
+        r = fwd[codes == code] * 100
+        if not len(r):
+            out[name] = {"n": 0}
+            continue
+        out[name] = {
+            "n": int(len(r)),
+            "share": len(r) / total * 100,
+            "mean": float(r.mean()),
+            "median": float(np.median(r)),
+            "std": float(r.std()),
+            "win": float((r > 0).mean() * 100),
+        }
+    return {"bars": int(len(close)), "labelled": total, "regimes": out}
+
+
+def backtest_job(db_path: str, symbol: str, tf: str, days: int, horizon: int) -> dict:
+    since_ms = int((time.time() - days * 86400) * 1000)
+    sync_history(db_path, symbol, tf, since_ms)
+    close = load_closes(db_path, symbol, tf, since_ms)
+    if len(close) < MA_WINDOW + horizon + 20:
+        raise ValueError(f"not enough history: {len(close)} bars")
+    result = regime_stats(close, horizon)
+    result.update(symbol=symbol, tf=tf, days=days, horizon=horizon)
+    return result
+
+
+# ----- bot side -----
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _cache_get(db_path: str, key: str) -> dict | None:
+    con = sqlite3.connect(db_path, timeout=30)
+    try:
+        row = con.execute(
+            "SELECT result FROM backtest_cache WHERE key=? AND created_at > ?", (key, int(time.time()) - RESULT_TTL)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    finally:
+        con.close()
+
+
+def _cache_put(db_path: str, key: str, result: dict) -> None:
+    con = sqlite3.connect(db_path, timeout=30)
+    try:
+        con.execute(
+            "INSERT OR REPLACE INTO backtest_cache (key, created_at, result) VALUES (?, ?, ?)",
+            (key, int(time.time()), json.dumps(result)),
+        )
+        con.commit()
+    finally:
+        con.close()
+
+
+def validate(tf: str, days: int) -> None:
+    if tf not in TIMEFRAMES:
+        raise ValueError(f"TF: {', '.join(TIMEFRAMES)}")
+    max_days = MAX_BARS * TIMEFRAMES[tf] // 86400
+    if not 1 <= days <= max_days:
+        raise ValueError(f"days: 1..{max_days} for {tf}")
+
+
+async def run_backtest(db_path: str, symbol: str, tf: str, days: int, horizon: int) -> dict:
+    validate(tf, days)
+    key = f"{symbol}|{tf}|{days}|{horizon}"
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(None, _cache_get, db_path, key)
+    if cached:
+        return cached
+    # Identical requests arriving while a run is in progress share its result.
+    fut = _inflight.get(key)
+    if fut is None:
+        fut = asyncio.ensure_future(
+            loop.run_in_executor(_get_pool(), backtest_job, db_path, symbol, tf, days, horizon)
+        )
+        _inflight[key] = fut
+        fut.add_done_callback(lambda _: _inflight.pop(key, None))
+    result = await asyncio.shield(fut)
+    await loop.run_in_executor(None, _cache_put, db_path, key, result)
+    return result
+
+
+def format_result(r: dict) -> str:
+    lines = [
+        f"{'REGIME':<9}{'N':>7}{'share':>7}{'mean%':>8}{'med%':>8}{'win%':>7}",
+    ]
+    for name, st in r["regimes"].items():
+        if not st["n"]:
+            lines.append(f"{name:<9}{0:>7}")
+            continue
+        lines.append(
+            f"{name:<9}{st['n']:>7}{st['share']:>6.1f}%{st['mean']:>8.2f}{st['median']:>8.2f}{st['win']:>7.1f}"
+        )
+    return "\n".join(lines)
@@ -1,41 +1,93 @@
 import io
-import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import ccxt
 
-def fetch_ohlcv(symbol: str, timeframe: str, limit: int = 220) -> pd.DataFrame:
-    ex = ccxt.gateio({"enableRateLimit": True})
-    ohlcv = ex.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
-    df = pd.DataFrame(ohlcv, columns=["ts","open","high","low","close","volume"])
-    df["dt"] = pd.to_datetime(df["ts"], unit="ms", utc=True)
-    return df
-
-def add_ma30(df: pd.DataFrame) -> pd.DataFrame:
-    df=df.copy()
-    df["ma30"] = df["close"].rolling(30).mean()
-    return df
-
-def detect_regime(df: pd.DataFrame) -> str:
-    ma = df["ma30"].dropna()
-    if len(ma) < 12:
+from .tracing import traced
+
+REGIMES = ("UNKNOWN", "TREND", "RANGE", "WEAKNESS")
+MA_WINDOW = 30
+SLOPE_LAG = 9
+MIN_MA_POINTS = 12
+
+
+class Candles:
+    # Columnar OHLCV: int64 timestamps (ms) plus one (5, n) float64 block whose
+    # rows are the open/high/low/close/volume columns. Column attributes are
+    # views into the block, and fetch -> indicators -> render pass the same
+    # object along without copying.
+    __slots__ = ("ts", "ohlcv", "open", "high", "low", "close", "volume", "ma30")
+
+    def __init__(self, ts: np.ndarray, ohlcv: np.ndarray):
+        self.ts = ts
+        self.ohlcv = ohlcv
+        self.open, self.high, self.low, self.close, self.volume = ohlcv
+        self.ma30 = None
+
+    @classmethod
+    def from_rows(cls, rows: list) -> "Candles":
+        arr = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+        return cls(arr[:, 0].astype(np.int64), np.ascontiguousarray(arr[:, 1:].T))
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @property
+    def dt(self) -> np.ndarray:
+        return self.ts.view("datetime64[ms]")
+
+    @property
+    def nbytes(self) -> int:
+        return self.ts.nbytes + self.ohlcv.nbytes + (self.ma30.nbytes if self.ma30 is not None else 0)
+
+
+@traced("exchange.fetch_ohlcv")
+def fetch_ohlcv(symbol: str, timeframe: str, limit: int = 220, ex=None) -> Candles:
+    ex = ex or ccxt.gateio({"enableRateLimit": True})
+    return Candles.from_rows(ex.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit))
+
+
+def rolling_mean(x: np.ndarray, window: int) -> np.ndarray:
+    out = np.full(len(x), np.nan)
+    if len(x) >= window:
+        out[window - 1:] = np.lib.stride_tricks.sliding_window_view(x, window).mean(axis=1)
+    return out
+
+
+def add_ma30(c: Candles) -> Candles:
+    c.ma30 = rolling_mean(c.close, MA_WINDOW)
+    return c
+
+
+def regime_codes(close: np.ndarray, ma: np.ndarray) -> np.ndarray:
+    # Vectorized detect_regime for every bar at once: element i is the label
+    # detect_regime would give on the series ending at bar i (index into REGIMES).
+    n = len(close)
+    slope = np.full(n, np.nan)
+    slope[SLOPE_LAG:] = ma[SLOPE_LAG:] - ma[:-SLOPE_LAG]
+    eps = np.abs(ma) * 0.0005 + 1e-9
+    codes = np.full(n, 2, dtype=np.int8)
+    codes[(slope < -eps) & (close <= ma)] = 3
+    codes[(slope > eps) & (close >= ma)] = 1
+    valid = np.cumsum(~np.isnan(ma)) >= MIN_MA_POINTS
+    codes[~valid] = 0
+    return codes
+
+
+def detect_regime(c: Candles) -> str:
+    if not len(c):
         return "UNKNOWN"
-    slope = ma.iloc[-1] - ma.iloc[-10]
-    price = df["close"].iloc[-1]
-    ma_last = ma.iloc[-1]
-    eps = abs(ma_last) * 0.0005 + 1e-9
-    if slope > eps and price >= ma_last:
-        return "TREND"
-    if abs(slope) <= eps:
-        return "RANGE"
-    if slope < -eps and price <= ma_last:
-        return "WEAKNESS"
-    return "RANGE"
-
-def render_png(df: pd.DataFrame, title: str) -> bytes:
+    # Only the tail matters for the last bar's label.
+    tail = MA_WINDOW + MIN_MA_POINTS
+    return REGIMES[regime_codes(c.close[-tail:], c.ma30[-tail:])[-1]]
+
+
+@traced("render_equity")
+def _figure_png(title: str, draw) -> bytes:
+    # Shared figure setup for the bot's charts; draw(ax) adds the series.
     fig = plt.figure(figsize=(10,5))
     ax = fig.add_subplot(111)
-    ax.plot(df["dt"], df["close"], label="close")
-    ax.plot(df["dt"], df["ma30"], label="MA30")
+    draw(ax)
     ax.set_title(title)
     ax.legend()
     fig.autofmt_xdate()
@@ -43,3 +95,19 @@ def render_png(df: pd.DataFrame, title: str) -> bytes:
     fig.savefig(buf, format="png", dpi=160, bbox_inches="tight")
     plt.close(fig)
     return buf.getvalue()
+
+
+def render_equity(ts: np.ndarray, equity: np.ndarray, title: str) -> bytes:
+    # ts: datetime64 per trade; equity: cumulative PnL %.
+    def draw(ax):
+        ax.step(ts, equity, where="post", label="Σ PnL %")
+        ax.axhline(0, color="grey", linewidth=0.8)
+    return _figure_png(title, draw)
+
+
+@traced("render_png")
+def render_png(c: Candles, title: str) -> bytes:
+    def draw(ax):
+        ax.plot(c.dt, c.close, label="close")
+        ax.plot(c.dt, c.ma30, label="MA30")
+    return _figure_png(title, draw)
@@ -0,0 +1,121 @@
+import asyncio
+import hmac
+import multiprocessing
+import queue
+from urllib.parse import urlparse
+
+from aiohttp import web
+
+from .config import Config, load_config
+from . import db
+from .coord import make_backend
+
+# Webhook mode: one front process receives updates and shards them by user id
+# onto N worker processes, so a user's updates (and FSM state) stay on one
+# worker while different users are handled in parallel.
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+QUEUE_SIZE = 10000
+
+
+def shard_key(update: dict) -> int:
+    # Every update type carries its payload under a single key; the actor is
+    # `from` (messages, callbacks, payments) or `user` (chat_member, polls).
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return int(user["id"])
+        chat = value.get("chat")
+        if chat:
+            return int(chat["id"])
+    return 0
+
+
+def worker_main(idx: int, updates) -> None:
+    asyncio.run(_worker(idx, updates))
+
+
+async def _worker(idx: int, updates) -> None:
+    from .app import build
+
+    cfg = load_config()
+    coord = await make_backend(cfg)
+    app = await build(cfg, coord, worker_id=f"worker-{idx}")
+    if idx == 0:
+        allowed = app.dp.resolve_used_update_types()
+        await app.bot.set_webhook(cfg.webhook_url, secret_token=cfg.webhook_secret, allowed_updates=allowed)
+        print(f"[cluster] webhook set url={cfg.webhook_url} allowed_updates={allowed}")
+    print(f"[cluster] worker-{idx} ready")
+
+    loop = asyncio.get_running_loop()
+    pending: set[asyncio.Task] = set()
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            t = asyncio.create_task(app.dp.feed_raw_update(app.bot, raw))
+            pending.add(t)
+            t.add_done_callback(pending.discard)
+    finally:
+        await asyncio.gather(*pending, return_exceptions=True)
+        await app.close()
+        await coord.close()
+
+
+async def serve(cfg: Config) -> None:
+    if cfg.workers > 1 and cfg.coord_backend == "memory":
+        raise SystemExit("WORKERS>1 needs a shared COORD_BACKEND (sqlite)")
+    # Migrations run once here, before any worker opens the database.
+    await db.init_db(cfg.db_path)
+
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue(QUEUE_SIZE) for _ in range(cfg.workers)]
+    procs: list = [None] * cfg.workers
+
+    def spawn(i: int) -> None:
+        # Not daemonic: workers start their own process pool for /backtest,
+        # and daemonic processes can't have children. Shutdown is explicit below.
+        p = ctx.Process(target=worker_main, args=(i, queues[i]), name=f"bot-worker-{i}", daemon=False)
+        p.start()
+        procs[i] = p
+
+    async def handle(request: web.Request) -> web.Response:
+        if cfg.webhook_secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), cfg.webhook_secret
+        ):
+            return web.Response(status=401)
+        update = await request.json()
+        try:
+            queues[shard_key(update) % len(queues)].put_nowait(update)
+        except queue.Full:
+            # Telegram retries non-2xx deliveries, so back-pressure is safe.
+            return web.Response(status=503)
+        return web.Response()
+
+    web_app = web.Application()
+    web_app.router.add_post(urlparse(cfg.webhook_url).path or "/", handle)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", cfg.webhook_port).start()
+    print(f"[cluster] listening on :{cfg.webhook_port} workers={cfg.workers} coord={cfg.coord_backend}")
+
+    for i in range(cfg.workers):
+        spawn(i)
+    try:
+        while True:
+            await asyncio.sleep(5)
+            for i, p in enumerate(procs):
+                if not p.is_alive():
+                    print(f"[cluster] worker-{i} exited code={p.exitcode}, restarting")
+                    spawn(i)
+    finally:
+        for q in queues:
+            q.put(None)
+        for p in procs:
+            p.join(10)
+            if p.is_alive():
+                p.terminate()
+        await runner.cleanup()
@@ -1,8 +1,6 @@
-import ccxt
+from .tracing import traced
 
-def top_movers(limit: int = 10, direction: str = "gainers") -> list[tuple[str, float]]:
-    ex = ccxt.gateio({"enableRateLimit": True})
-    tickers = ex.fetch_tickers()
+def usdt_changes(tickers: dict) -> list[tuple[str, float]]:
     items=[]
     for sym, t in tickers.items():
         if not sym.endswith("/USDT"):
@@ -16,8 +14,11 @@ def top_movers(limit: int = 10, direction: str = "gainers") -> list[tuple[str, f
         if pct is None:
             continue
         items.append((sym, float(pct)))
-    if direction == "gainers":
-        items.sort(key=lambda x: x[1], reverse=True)
-    else:
-        items.sort(key=lambda x: x[1])
-    return items[:limit]
+    return items
+
+def pick_movers(items: list[tuple[str, float]], limit: int = 10, direction: str = "gainers") -> list[tuple[str, float]]:
+    return sorted(items, key=lambda x: x[1], reverse=(direction == "gainers"))[:limit]
+
+@traced("exchange.fetch_tickers")
+def fetch_usdt_changes(ex) -> list[tuple[str, float]]:
+    return usdt_changes(ex.fetch_tickers())
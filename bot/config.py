@@ -12,8 +12,20 @@ class Config:
     stars_price: int
     stars_title: str
     stars_description: str
+    payment_pending_ttl_min: int
+    invite_pool_size: int
+    workers: int
+    webhook_url: str | None
+    webhook_port: int
+    webhook_secret: str | None
+    coord_backend: str
+    coord_db_path: str
+    trace_file: str
+    trace_sample: float
+    trace_slow_ms: float
 
 def load_config() -> Config:
+    workers = int(os.environ.get("WORKERS","1"))
     return Config(
         bot_token=os.environ["BOT_TOKEN"],
         admin_user_id=int(os.environ["ADMIN_USER_ID"]),
@@ -24,4 +36,15 @@ def load_config() -> Config:
         stars_price=int(os.environ.get("STARS_PRICE","199")),
         stars_title=os.environ.get("STARS_TITLE","Access 30 days"),
         stars_description=os.environ.get("STARS_DESCRIPTION","Trading bot access for 30 days"),
+        payment_pending_ttl_min=int(os.environ.get("PAYMENT_PENDING_TTL_MIN","1440")),
+        invite_pool_size=int(os.environ.get("INVITE_POOL_SIZE","20")),
+        workers=workers,
+        webhook_url=os.environ.get("WEBHOOK_URL","").strip() or None,
+        webhook_port=int(os.environ.get("WEBHOOK_PORT","8080")),
+        webhook_secret=os.environ.get("WEBHOOK_SECRET","").strip() or None,
+        coord_backend=os.environ.get("COORD_BACKEND","").strip() or ("sqlite" if workers > 1 else "memory"),
+        coord_db_path=os.environ.get("COORD_DB_PATH","/data/coord.sqlite3"),
+        trace_file=os.environ.get("TRACE_FILE","/data/traces.jsonl"),
+        trace_sample=float(os.environ.get("TRACE_SAMPLE","0")),
+        trace_slow_ms=float(os.environ.get("TRACE_SLOW_MS","0")),
     )
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, Mapping, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+# State shared between bot workers: FSM, cache invalidation, rate limits and
+# job leases. MemoryBackend serves a single process (polling mode);
+# SQLiteBackend lets several worker processes on one host share a file. Any
+# other store (e.g. Redis) can be plugged in by implementing the same methods.
+
+
+class CoordinationBackend:
+    async def init(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def get(self, key: str) -> str | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def incr(self, key: str, window: float) -> int:
+        # Hits on `key` in the current fixed window of `window` seconds.
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str) -> None:
+        raise NotImplementedError
+
+    async def poll(self, channel: str, after_id: int) -> list[tuple[int, str]]:
+        raise NotImplementedError
+
+    async def last_event_id(self) -> int:
+        raise NotImplementedError
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        # Takes or renews the lease; True while `owner` holds it.
+        raise NotImplementedError
+
+
+class MemoryBackend(CoordinationBackend):
+    def __init__(self):
+        self._kv: dict[str, tuple[str, float | None]] = {}
+        self._counters: dict[str, int] = {}
+        self._events: list[tuple[int, str, str]] = []
+        self._leases: dict[str, tuple[str, float]] = {}
+
+    async def get(self, key: str) -> str | None:
+        item = self._kv.get(key)
+        if item is None or (item[1] is not None and item[1] <= time.time()):
+            return None
+        return item[0]
+
+    async def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        self._kv[key] = (value, time.time() + ttl if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        self._kv.pop(key, None)
+
+    async def incr(self, key: str, window: float) -> int:
+        bucket = int(time.time() // window)
+        k = f"{key}:{bucket}"
+        if len(self._counters) > 10000:
+            self._counters = {c: v for c, v in self._counters.items() if c.endswith(f":{bucket}")}
+        self._counters[k] = self._counters.get(k, 0) + 1
+        return self._counters[k]
+
+    async def publish(self, channel: str, message: str) -> None:
+        eid = self._events[-1][0] + 1 if self._events else 1
+        self._events.append((eid, channel, message))
+        del self._events[:-1000]
+
+    async def poll(self, channel: str, after_id: int) -> list[tuple[int, str]]:
+        return [(i, m) for i, c, m in self._events if i > after_id and c == channel]
+
+    async def last_event_id(self) -> int:
+        return self._events[-1][0] if self._events else 0
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        held = self._leases.get(name)
+        if held is None or held[0] == owner or held[1] < now:
+            self._leases[name] = (owner, now + ttl)
+            return True
+        return False
+
+
+SQLITE_SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS kv (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL,
+  expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS counters (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL,
+  expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  channel TEXT NOT NULL,
+  message TEXT NOT NULL,
+  created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_channel ON events(channel, id);
+CREATE TABLE IF NOT EXISTS leases (
+  name TEXT PRIMARY KEY,
+  owner TEXT NOT NULL,
+  expires_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteBackend(CoordinationBackend):
+    # One autocommit connection per process; every method is a single
+    # statement (or UPSERT), so concurrent workers stay consistent.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: aiosqlite.Connection | None = None
+        self._next_prune = 0.0
+
+    async def init(self) -> None:
+        self._db = await aiosqlite.connect(self.path, isolation_level=None, timeout=30)
+        await self._db.executescript(SQLITE_SCHEMA)
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def _prune(self, now: float) -> None:
+        if now < self._next_prune:
+            return
+        self._next_prune = now + 60
+        await self._db.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        await self._db.execute("DELETE FROM counters WHERE expires_at <= ?", (now,))
+        await self._db.execute("DELETE FROM events WHERE created_at <= ?", (now - 3600,))
+
+    async def get(self, key: str) -> str | None:
+        cur = await self._db.execute(
+            "SELECT value FROM kv WHERE key=? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        )
+        row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        now = time.time()
+        await self._db.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, now + ttl if ttl else None),
+        )
+        await self._prune(now)
+
+    async def delete(self, key: str) -> None:
+        await self._db.execute("DELETE FROM kv WHERE key=?", (key,))
+
+    async def incr(self, key: str, window: float) -> int:
+        now = time.time()
+        bucket = int(now // window)
+        cur = await self._db.execute(
+            "INSERT INTO counters (key, value, expires_at) VALUES (?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1 RETURNING value",
+            (f"{key}:{bucket}", (bucket + 1) * window),
+        )
+        row = await cur.fetchone()
+        await self._prune(now)
+        return int(row[0])
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self._db.execute(
+            "INSERT INTO events (channel, message, created_at) VALUES (?, ?, ?)", (channel, message, time.time())
+        )
+
+    async def poll(self, channel: str, after_id: int) -> list[tuple[int, str]]:
+        cur = await self._db.execute(
+            "SELECT id, message FROM events WHERE channel=? AND id>? ORDER BY id", (channel, after_id)
+        )
+        return [(int(r[0]), r[1]) for r in await cur.fetchall()]
+
+    async def last_event_id(self) -> int:
+        cur = await self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events")
+        return int((await cur.fetchone())[0])
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        await self._db.execute(
+            """
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+            WHERE leases.owner=excluded.owner OR leases.expires_at < ?
+            """,
+            (name, owner, now + ttl, now),
+        )
+        cur = await self._db.execute("SELECT owner FROM leases WHERE name=?", (name,))
+        row = await cur.fetchone()
+        return bool(row) and row[0] == owner
+
+
+async def make_backend(cfg) -> CoordinationBackend:
+    backend = SQLiteBackend(cfg.coord_db_path) if cfg.coord_backend == "sqlite" else MemoryBackend()
+    await backend.init()
+    return backend
+
+
+class CoordStorage(BaseStorage):
+    # aiogram FSM storage on top of a coordination backend, so a conversation
+    # can continue on whichever worker receives the next update.
+
+    def __init__(self, backend: CoordinationBackend):
+        self.backend = backend
+        self.key_builder = DefaultKeyBuilder(with_destiny=True, with_business_connection_id=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key, "state")
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            await self.backend.delete(k)
+        else:
+            await self.backend.set(k, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.backend.get(self.key_builder.build(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        k = self.key_builder.build(key, "data")
+        if not data:
+            await self.backend.delete(k)
+        else:
+            await self.backend.set(k, json.dumps(dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = await self.backend.get(self.key_builder.build(key, "data"))
+        return json.loads(raw) if raw else {}
+
+    async def close(self) -> None:
+        pass
+
+
+class InvalidationBus:
+    # Cross-worker cache invalidation: publish() drops the key locally and
+    # records an event; every worker's run() loop polls events and applies them.
+
+    def __init__(self, backend: CoordinationBackend, channel: str = "invalidate", interval: float = 1.0):
+        self.backend = backend
+        self.channel = channel
+        self.interval = interval
+        self._subscribers: dict[str, list] = {}
+        self._last_id = 0
+
+    def subscribe(self, namespace: str, callback) -> None:
+        self._subscribers.setdefault(namespace, []).append(callback)
+
+    def _apply(self, message: str) -> None:
+        namespace, _, key = message.partition(":")
+        for cb in self._subscribers.get(namespace, ()):
+            cb(key)
+
+    async def publish(self, namespace: str, key) -> None:
+        message = f"{namespace}:{key}"
+        self._apply(message)
+        await self.backend.publish(self.channel, message)
+
+    async def run(self) -> None:
+        self._last_id = await self.backend.last_event_id()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                for eid, message in await self.backend.poll(self.channel, self._last_id):
+                    self._last_id = eid
+                    self._apply(message)
+            except Exception as e:
+                print(f"[coord] invalidation poll failed: {e}")
+
+
+class LocalCache:
+    # Per-process TTL cache whose entries are dropped on every worker when a
+    # key is published on the bus namespace.
+
+    def __init__(self, bus: InvalidationBus, namespace: str, ttl: float, maxsize: int = 50000):
+        self.bus = bus
+        self.namespace = namespace
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: dict[str, tuple[Any, float]] = {}
+        self.hits = 0
+        self.misses = 0
+        bus.subscribe(namespace, self._drop)
+
+    def _drop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def get_or_load(self, key, loader):
+        k = str(key)
+        now = time.monotonic()
+        item = self._data.get(k)
+        if item is not None and item[1] > now:
+            self.hits += 1
+            return item[0]
+        self.misses += 1
+        value = await loader()
+        if len(self._data) >= self.maxsize:
+            self._data = {kk: v for kk, v in self._data.items() if v[1] > now}
+            if len(self._data) >= self.maxsize:
+                self._data.clear()
+        self._data[k] = (value, now + self.ttl)
+        return value
+
+    async def invalidate(self, key) -> None:
+        await self.bus.publish(self.namespace, key)
+
+
+class SharedRateLimiter:
+    # Caps calls across all workers to `rate` per second.
+
+    def __init__(self, backend: CoordinationBackend, key: str, rate: float):
+        self.backend = backend
+        self.key = key
+        self.rate = rate
+
+    async def acquire(self) -> None:
+        while True:
+            if await self.backend.incr(self.key, 1.0) <= self.rate:
+                return
+            await asyncio.sleep(1.0 - time.time() % 1.0)
+
+
+class Lease:
+    # Lets exactly one worker run singleton jobs; checked lazily and renewed
+    # every ttl/3 by whoever holds it.
+
+    def __init__(self, backend: CoordinationBackend, name: str, owner: str, ttl: float = 30.0):
+        self.backend = backend
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        self._held = False
+        self._checked_until = 0.0
+
+    async def held(self) -> bool:
+        now = time.monotonic()
+        if now >= self._checked_until:
+            self._held = await self.backend.acquire_lease(self.name, self.owner, self.ttl)
+            self._checked_until = now + self.ttl / 3
+        return self._held
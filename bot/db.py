@@ -1,6 +1,11 @@
 import aiosqlite
+import time
 from datetime import datetime, timedelta, timezone
 
+from .migrations import migrate
+from .tracing import instrument_module
+from .trades import STATS_UPSERT, TRADE_INSERT, Trade, parse_trade, stats_params, trade_params
+
 SCHEMA = """
 PRAGMA journal_mode=WAL;
 
@@ -58,22 +63,31 @@ CREATE TABLE IF NOT EXISTS payments (
 def now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
+def now_ts() -> int:
+    return int(time.time())
+
 async def init_db(db_path: str) -> None:
-    async with aiosqlite.connect(db_path) as db:
+    # SCHEMA is the frozen baseline; every later change lives in migrations.py.
+    async with aiosqlite.connect(db_path, isolation_level=None) as db:
         await db.executescript(SCHEMA)
-        await db.commit()
+        await migrate(db)
 
-async def upsert_user(db_path: str, user_id: int, username: str | None) -> None:
+async def upsert_user(db_path: str, user_id: int, username: str | None) -> bool:
+    # True if the user was created by this call.
+    now = now_iso()
     async with aiosqlite.connect(db_path) as db:
-        await db.execute(
+        cur = await db.execute(
             """
             INSERT INTO users (user_id, username, created_at)
             VALUES (?, ?, ?)
             ON CONFLICT(user_id) DO UPDATE SET username=excluded.username
+            RETURNING created_at
             """,
-            (user_id, username, now_iso()),
+            (user_id, username, now),
         )
+        row = await cur.fetchone()
         await db.commit()
+        return row[0] == now
 
 async def set_disclaimer(db_path: str, user_id: int) -> None:
     async with aiosqlite.connect(db_path) as db:
@@ -99,18 +113,39 @@ async def is_access_active(db_path: str, user_id: int) -> bool:
     if u.get("is_whitelisted") == 1:
         return True
     until = u.get("access_until")
-    if not until:
-        return False
-    try:
-        dt = datetime.fromisoformat(until.replace("Z", "+00:00"))
-    except Exception:
-        return False
-    return dt > datetime.now(timezone.utc)
+    return bool(until) and int(until) > now_ts()
+
+USERS_EXPIRING_SELECT = """
+SELECT u.user_id, u.access_until FROM users u
+WHERE u.access_until > ? AND u.access_until <= ? AND u.is_whitelisted=0
+  AND (u.access_until, u.user_id) > (?, ?)
+  AND NOT EXISTS (
+    SELECT 1 FROM access_notices n
+    WHERE n.user_id=u.user_id AND n.access_until=u.access_until AND n.kind=?
+  )
+ORDER BY u.access_until, u.user_id LIMIT ?
+"""
+
+async def users_expiring(
+    db_path: str, start_ts: int, end_ts: int, kind: str, limit: int = 500, after: tuple[int, int] | None = None
+) -> list[tuple[int, int]]:
+    # Range seek on idx_users_access_until: cost follows the window, not the user count.
+    # `after` is the last (user_id, access_until) seen, for callers that leave
+    # some rows unmarked and must move past them.
+    after_until, after_uid = (after[1], after[0]) if after else (start_ts, 0)
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(
+            USERS_EXPIRING_SELECT, (start_ts, end_ts, after_until, after_uid, kind, limit)
+        )
+        rows = await cur.fetchall()
+        return [(int(r[0]), int(r[1])) for r in rows]
 
-async def grant_access_30d(db_path: str, user_id: int) -> None:
-    until = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+async def mark_access_notices(db_path: str, kind: str, items: list[tuple[int, int]]) -> None:
     async with aiosqlite.connect(db_path) as db:
-        await db.execute("UPDATE users SET access_until=? WHERE user_id=?", (until, user_id))
+        await db.executemany(
+            "INSERT OR IGNORE INTO access_notices (user_id, access_until, kind, sent_at) VALUES (?, ?, ?, ?)",
+            [(uid, until, kind, now_iso()) for uid, until in items],
+        )
         await db.commit()
 
 async def set_whitelist(db_path: str, user_id: int, value: bool) -> None:
@@ -132,9 +167,11 @@ async def remove_favorite(db_path: str, user_id: int, symbol: str) -> None:
         await db.execute("DELETE FROM favorites WHERE user_id=? AND symbol=?", (user_id, symbol))
         await db.commit()
 
+FAVORITES_SELECT = "SELECT symbol FROM favorites WHERE user_id=? ORDER BY created_at DESC LIMIT ?"
+
 async def list_favorites(db_path: str, user_id: int, limit: int = 30) -> list[str]:
     async with aiosqlite.connect(db_path) as db:
-        cur = await db.execute("SELECT symbol FROM favorites WHERE user_id=? ORDER BY created_at DESC LIMIT ?", (user_id, limit))
+        cur = await db.execute(FAVORITES_SELECT, (user_id, limit))
         rows = await cur.fetchall()
         return [r[0] for r in rows]
 
@@ -166,48 +203,500 @@ async def close_ticket(db_path: str, ticket_id: int) -> None:
         await db.execute("UPDATE tickets SET status='closed', closed_at=? WHERE ticket_id=?", (now_iso(), ticket_id))
         await db.commit()
 
+OPEN_TICKETS_SELECT = "SELECT * FROM tickets WHERE status='open' ORDER BY ticket_id DESC LIMIT ?"
+
 async def get_open_tickets(db_path: str, limit: int = 20) -> list[dict]:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM tickets WHERE status='open' ORDER BY ticket_id DESC LIMIT ?", (limit,))
+        cur = await db.execute(OPEN_TICKETS_SELECT, (limit,))
         rows = await cur.fetchall()
         return [dict(r) for r in rows]
 
-# Journal
-async def add_journal(db_path: str, user_id: int, text: str) -> None:
+async def get_ticket(db_path: str, ticket_id: int) -> dict | None:
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        cur = await db.execute("SELECT * FROM tickets WHERE ticket_id=?", (ticket_id,))
+        row = await cur.fetchone()
+        return dict(row) if row else None
+
+async def set_ticket_thread(db_path: str, ticket_id: int, thread_id: int | None, group_message_id: int | None) -> None:
     async with aiosqlite.connect(db_path) as db:
         await db.execute(
+            "UPDATE tickets SET thread_id=?, group_message_id=? WHERE ticket_id=?",
+            (thread_id, group_message_id, ticket_id),
+        )
+        await db.commit()
+
+TICKET_BY_THREAD_SELECT = "SELECT * FROM tickets WHERE thread_id=?"
+TICKET_BY_GROUP_MESSAGE_SELECT = "SELECT * FROM tickets WHERE group_message_id=?"
+
+async def find_ticket_by_group_message(
+    db_path: str, thread_id: int | None, reply_to_message_id: int | None
+) -> dict | None:
+    # Forum topics map by thread id; plain groups by the ticket card the admin replied to.
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        row = None
+        if thread_id is not None:
+            cur = await db.execute(TICKET_BY_THREAD_SELECT, (thread_id,))
+            row = await cur.fetchone()
+        if row is None and reply_to_message_id is not None:
+            cur = await db.execute(TICKET_BY_GROUP_MESSAGE_SELECT, (reply_to_message_id,))
+            row = await cur.fetchone()
+        return dict(row) if row else None
+
+# Per-ticket counts are correlated lookups on idx_ticket_messages_ticket, so
+# the page is read in index order with no grouping or sort.
+OPEN_TICKETS_PAGE_SELECT = """
+SELECT t.ticket_id, t.user_id, t.created_at, u.username,
+       (SELECT COUNT(*) FROM ticket_messages m WHERE m.ticket_id = t.ticket_id) AS n_messages,
+       (SELECT lm.text FROM ticket_messages lm
+        WHERE lm.ticket_id = t.ticket_id ORDER BY lm.id DESC LIMIT 1) AS last_text
+FROM tickets t
+LEFT JOIN users u ON u.user_id = t.user_id
+WHERE t.status='open' AND t.ticket_id<?
+ORDER BY t.ticket_id DESC LIMIT ?
+"""
+
+async def open_tickets_page(db_path: str, before_id: int | None = None, limit: int = 10) -> tuple[list[dict], bool]:
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        cur = await db.execute(
+            OPEN_TICKETS_PAGE_SELECT, (before_id if before_id is not None else 2**63 - 1, limit + 1)
+        )
+        rows = [dict(r) for r in await cur.fetchall()]
+        return rows[:limit], len(rows) > limit
+
+TICKET_HISTORY_SELECT = (
+    "SELECT id, sender, text, created_at FROM ticket_messages WHERE ticket_id=? ORDER BY id DESC LIMIT ?"
+)
+
+async def ticket_history(db_path: str, ticket_id: int, limit: int = 15) -> list[dict]:
+    # Latest `limit` messages, oldest first.
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        cur = await db.execute(TICKET_HISTORY_SELECT, (ticket_id, limit))
+        return [dict(r) for r in reversed(await cur.fetchall())]
+
+# Journal
+async def add_journal(db_path: str, user_id: int, text: str) -> Trade | None:
+    # A note that parses as a trade also gets a trades row; its aggregates
+    # are updated in the same transaction, so stats never need a rescan.
+    trade = parse_trade(text)
+    created_at = now_iso()
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(
             "INSERT INTO journal_entries (user_id, text, created_at) VALUES (?, ?, ?)",
-            (user_id, text, now_iso()),
+            (user_id, text, created_at),
         )
+        if trade is not None:
+            await db.execute(TRADE_INSERT, trade_params(cur.lastrowid, user_id, trade, created_at))
+            await db.executemany(STATS_UPSERT, stats_params(user_id, trade))
         await db.commit()
+    return trade
+
+async def trade_stats(db_path: str, user_id: int) -> list[dict]:
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        cur = await db.execute("SELECT * FROM trade_stats WHERE user_id=?", (user_id,))
+        return [dict(r) for r in await cur.fetchall()]
 
-async def list_journal(db_path: str, user_id: int, limit: int = 20) -> list[tuple[str,str]]:
+async def equity_points(db_path: str, user_id: int, limit: int = 5000) -> list[tuple[str, float]]:
+    # Latest `limit` trades, oldest first.
     async with aiosqlite.connect(db_path) as db:
         cur = await db.execute(
-            "SELECT created_at, text FROM journal_entries WHERE user_id=? ORDER BY id DESC LIMIT ?",
+            "SELECT created_at, pnl_pct FROM (SELECT id, created_at, pnl_pct FROM trades "
+            "WHERE user_id=? ORDER BY id DESC LIMIT ?) ORDER BY id",
             (user_id, limit),
         )
+        return [(r[0], float(r[1])) for r in await cur.fetchall()]
+
+JOURNAL_NEWER_SELECT = (
+    "SELECT id, created_at, text FROM journal_entries WHERE user_id=? AND id>? ORDER BY id ASC LIMIT ?"
+)
+JOURNAL_OLDER_SELECT = (
+    "SELECT id, created_at, text FROM journal_entries WHERE user_id=? AND id<? ORDER BY id DESC LIMIT ?"
+)
+
+async def journal_page(
+    db_path: str, user_id: int, before_id: int | None = None, after_id: int | None = None, limit: int = 8
+) -> tuple[list[tuple[int, str, str]], bool, bool]:
+    # Keyset pagination by id: each page is an index range seek, independent of
+    # how deep into the history it is. Returns (rows newest first, has_older, has_newer).
+    async with aiosqlite.connect(db_path) as db:
+        rows = []
+        if after_id is not None:
+            cur = await db.execute(JOURNAL_NEWER_SELECT, (user_id, after_id, limit))
+            rows = list(reversed(await cur.fetchall()))
+        if len(rows) < limit:
+            cur = await db.execute(
+                JOURNAL_OLDER_SELECT, (user_id, before_id if before_id is not None else 2**63 - 1, limit)
+            )
+            rows = await cur.fetchall()
+        if not rows:
+            return [], False, False
+        cur = await db.execute(
+            "SELECT EXISTS(SELECT 1 FROM journal_entries WHERE user_id=? AND id<?), "
+            "EXISTS(SELECT 1 FROM journal_entries WHERE user_id=? AND id>?)",
+            (user_id, rows[-1][0], user_id, rows[0][0]),
+        )
+        has_older, has_newer = await cur.fetchone()
+        return [(int(r[0]), r[1], r[2]) for r in rows], bool(has_older), bool(has_newer)
+
+def _fts_query(query: str) -> str:
+    # Quote every term so user input can't inject FTS5 syntax; prefix-match each.
+    return " ".join('"' + t.replace('"', '""') + '"*' for t in query.split())
+
+JOURNAL_SEARCH_SELECT = """
+SELECT j.id, j.created_at, j.text
+FROM journal_fts JOIN journal_entries j ON j.id = journal_fts.rowid
+WHERE journal_fts MATCH ? AND j.user_id=?
+ORDER BY j.id DESC LIMIT ?
+"""
+
+async def search_journal(db_path: str, user_id: int, query: str, limit: int = 8) -> list[tuple[int, str, str]]:
+    match = _fts_query(query)
+    if not match:
+        return []
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(JOURNAL_SEARCH_SELECT, (match, user_id, limit))
         rows = await cur.fetchall()
-        return [(r[0], r[1]) for r in rows]
+        return [(int(r[0]), r[1], r[2]) for r in rows]
+
+async def iter_journal(db_path: str, user_id: int, batch: int = 500):
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(
+            "SELECT created_at, text FROM journal_entries WHERE user_id=? ORDER BY id", (user_id,)
+        )
+        while True:
+            rows = await cur.fetchmany(batch)
+            if not rows:
+                break
+            for r in rows:
+                yield r[0], r[1]
 
 # Payments
 async def create_payment(db_path: str, user_id: int, payload: str, stars_amount: int) -> None:
     async with aiosqlite.connect(db_path) as db:
         await db.execute(
-            "INSERT OR REPLACE INTO payments (user_id, payload, stars_amount, status, created_at) VALUES (?, ?, ?, 'pending', ?)",
+            "INSERT INTO payments (user_id, payload, stars_amount, status, created_at) VALUES (?, ?, ?, 'pending', ?) "
+            "ON CONFLICT(payload) DO NOTHING",
             (user_id, payload, stars_amount, now_iso()),
         )
         await db.commit()
 
-async def mark_payment_paid(db_path: str, payload: str) -> None:
+async def get_payment(db_path: str, payload: str) -> dict | None:
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        cur = await db.execute("SELECT * FROM payments WHERE payload=?", (payload,))
+        row = await cur.fetchone()
+        return dict(row) if row else None
+
+async def apply_payment(
+    db_path: str, payload: str, user_id: int, total_amount: int, charge_id: str, days: int = 30
+) -> str:
+    # Returns "ok", "duplicate", "unknown" or "mismatch".
+    async with aiosqlite.connect(db_path, isolation_level=None) as db:
+        db.row_factory = aiosqlite.Row
+        # IMMEDIATE takes the write lock up front so two deliveries of the same
+        # charge cannot both pass the checks below.
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = await db.execute(
+                "SELECT 1 FROM payments WHERE telegram_payment_charge_id=?", (charge_id,)
+            )
+            if await cur.fetchone():
+                await db.execute("ROLLBACK")
+                return "duplicate"
+            cur = await db.execute(
+                "SELECT user_id, stars_amount, status FROM payments WHERE payload=?", (payload,)
+            )
+            p = await cur.fetchone()
+            if not p or int(p["user_id"]) != user_id:
+                await db.execute("ROLLBACK")
+                return "unknown"
+            if p["status"] == "paid":
+                await db.execute("ROLLBACK")
+                return "duplicate"
+            if int(p["stars_amount"]) != int(total_amount):
+                await db.execute("ROLLBACK")
+                return "mismatch"
+            now = now_iso()
+            await db.execute(
+                "UPDATE payments SET status='paid', paid_at=?, telegram_payment_charge_id=? WHERE payload=?",
+                (now, charge_id, payload),
+            )
+            await db.execute(
+                "INSERT INTO users (user_id, created_at) VALUES (?, ?) ON CONFLICT(user_id) DO NOTHING",
+                (user_id, now),
+            )
+            await db.execute(
+                "UPDATE users SET access_until = MAX(COALESCE(access_until, 0), ?) + ? WHERE user_id=?",
+                (now_ts(), days * 86400, user_id),
+            )
+            await db.execute("COMMIT")
+            return "ok"
+        except Exception:
+            await db.execute("ROLLBACK")
+            raise
+
+async def expire_stale_payments(db_path: str, older_than: timedelta) -> int:
+    cutoff = (datetime.now(timezone.utc) - older_than).isoformat()
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(
+            "UPDATE payments SET status='expired' WHERE status='pending' AND created_at < ?",
+            (cutoff,),
+        )
+        await db.commit()
+        return cur.rowcount
+
+# Invite links
+async def add_invite_links(
+    db_path: str, chat_id: int, links: list[tuple[str, int]], user_id: int | None = None
+) -> None:
+    issued_at = now_ts() if user_id is not None else None
     async with aiosqlite.connect(db_path) as db:
-        await db.execute("UPDATE payments SET status='paid', paid_at=? WHERE payload=?", (now_iso(), payload))
+        await db.executemany(
+            "INSERT OR IGNORE INTO invite_links (chat_id, link, created_at, expires_at, user_id, issued_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(chat_id, link, now_iso(), expires_at, user_id, issued_at) for link, expires_at in links],
+        )
         await db.commit()
 
-async def get_payment(db_path: str, payload: str) -> dict | None:
+async def count_free_invite_links(db_path: str, chat_id: int, min_expires: int) -> int:
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(
+            "SELECT COUNT(*) FROM invite_links WHERE chat_id=? AND user_id IS NULL AND revoked_at IS NULL "
+            "AND expires_at > ?",
+            (chat_id, min_expires),
+        )
+        return int((await cur.fetchone())[0])
+
+INVITE_ISSUED_SELECT = (
+    "SELECT link FROM invite_links WHERE user_id=? AND chat_id=? AND revoked_at IS NULL "
+    "AND expires_at > ? ORDER BY id DESC LIMIT 1"
+)
+INVITE_POP_UPDATE = """
+UPDATE invite_links SET user_id=?, issued_at=?
+WHERE id = (
+    SELECT id FROM invite_links
+    WHERE chat_id=? AND user_id IS NULL AND revoked_at IS NULL AND expires_at > ?
+    ORDER BY expires_at LIMIT 1
+)
+RETURNING link
+"""
+
+async def pop_invite_link(db_path: str, chat_id: int, user_id: int, min_expires: int) -> str | None:
+    # A user who already holds a live, unused link gets the same one back.
+    async with aiosqlite.connect(db_path, isolation_level=None) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = await db.execute(INVITE_ISSUED_SELECT, (user_id, chat_id, min_expires))
+            row = await cur.fetchone()
+            if not row:
+                cur = await db.execute(INVITE_POP_UPDATE, (user_id, now_ts(), chat_id, min_expires))
+                row = await cur.fetchone()
+            await db.execute("COMMIT")
+            return row[0] if row else None
+        except Exception:
+            await db.execute("ROLLBACK")
+            raise
+
+async def issued_invite_links(db_path: str, chat_id: int, user_id: int) -> list[str]:
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(
+            "SELECT link FROM invite_links WHERE user_id=? AND chat_id=? AND revoked_at IS NULL", (user_id, chat_id)
+        )
+        return [r[0] for r in await cur.fetchall()]
+
+async def mark_invite_link_used(db_path: str, link: str) -> bool:
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(
+            "UPDATE invite_links SET revoked_at=? WHERE link=? AND revoked_at IS NULL", (now_ts(), link)
+        )
+        await db.commit()
+        return cur.rowcount > 0
+
+async def purge_invite_links(db_path: str, chat_id: int, now: int) -> None:
+    # Links carry expire_date, so Telegram invalidates expired ones itself; here
+    # unissued ones are dropped and issued ones marked revoked.
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute(
+            "DELETE FROM invite_links WHERE chat_id=? AND user_id IS NULL AND revoked_at IS NULL AND expires_at <= ?",
+            (chat_id, now),
+        )
+        await db.execute(
+            "UPDATE invite_links SET revoked_at=? WHERE chat_id=? AND user_id IS NOT NULL "
+            "AND revoked_at IS NULL AND expires_at <= ?",
+            (now, chat_id, now),
+        )
+        await db.commit()
+
+# Broadcasts
+async def create_broadcast(db_path: str, text: str, notify_chat_id: int | None) -> int:
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(
+            "INSERT INTO broadcast_jobs (text, notify_chat_id, status, created_at) VALUES (?, ?, 'running', ?)",
+            (text, notify_chat_id, now_iso()),
+        )
+        await db.commit()
+        return int(cur.lastrowid)
+
+async def next_broadcast(db_path: str) -> dict | None:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM payments WHERE payload=?", (payload,))
+        cur = await db.execute("SELECT * FROM broadcast_jobs WHERE status='running' ORDER BY id LIMIT 1")
         row = await cur.fetchone()
         return dict(row) if row else None
+
+BROADCAST_RECIPIENTS_SELECT = (
+    "SELECT user_id FROM users WHERE user_id>? AND (is_whitelisted=1 OR access_until>?) ORDER BY user_id LIMIT ?"
+)
+
+async def active_user_ids_after(db_path: str, after_user_id: int, limit: int = 200) -> list[int]:
+    # Keyset walk over the primary key; the cursor lets another worker resume.
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(BROADCAST_RECIPIENTS_SELECT, (after_user_id, now_ts(), limit))
+        return [int(r[0]) for r in await cur.fetchall()]
+
+async def advance_broadcast(db_path: str, job_id: int, cursor_user_id: int, sent: int) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute(
+            "UPDATE broadcast_jobs SET cursor_user_id=?, sent=sent+? WHERE id=?", (cursor_user_id, sent, job_id)
+        )
+        await db.commit()
+
+async def finish_broadcast(db_path: str, job_id: int) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute(
+            "UPDATE broadcast_jobs SET status='done', finished_at=? WHERE id=?", (now_iso(), job_id)
+        )
+        await db.commit()
+
+
+# Daily digest
+async def set_digest_time(db_path: str, user_id: int, minute: int | None) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute("UPDATE users SET digest_minute=? WHERE user_id=?", (minute, user_id))
+        await db.commit()
+
+DIGEST_DUE_SELECT = (
+    "SELECT user_id FROM users WHERE digest_minute IS NOT NULL AND digest_minute<=? "
+    "AND (digest_sent_on IS NULL OR digest_sent_on<?) "
+    "AND (is_whitelisted=1 OR access_until>?) LIMIT ?"
+)
+
+async def users_due_digest(db_path: str, minute: int, day: str, limit: int = 500) -> list[int]:
+    # Due = digest time has passed today and not yet sent today; users without
+    # access never match, so repeated calls drain once everyone is marked.
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(DIGEST_DUE_SELECT, (minute, day, now_ts(), limit))
+        return [int(r[0]) for r in await cur.fetchall()]
+
+async def mark_digest_sent(db_path: str, user_ids: list[int], day: str) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await db.executemany("UPDATE users SET digest_sent_on=? WHERE user_id=?", [(day, uid) for uid in user_ids])
+        await db.commit()
+
+# {marks}: one "?" per user id. Both keys descend so the IN list is walked
+# backwards over idx_favorites_user_created, with no sort.
+FAVORITES_FOR_USERS_SELECT = (
+    "SELECT user_id, symbol FROM favorites WHERE user_id IN ({marks}) ORDER BY user_id DESC, created_at DESC"
+)
+
+async def favorites_for_users(db_path: str, user_ids: list[int], per_user: int = 10) -> dict[int, list[str]]:
+    out: dict[int, list[str]] = {}
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(FAVORITES_FOR_USERS_SELECT.format(marks=",".join("?" * len(user_ids))), user_ids)
+        for uid, sym in await cur.fetchall():
+            syms = out.setdefault(int(uid), [])
+            if len(syms) < per_user:
+                syms.append(sym)
+    return out
+
+
+# Analytics rollups
+async def add_daily_stats(db_path: str, day: str, counts: dict[tuple[str, str], int], seen: set[int]) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        if seen:
+            before = db.total_changes
+            await db.executemany(
+                "INSERT OR IGNORE INTO daily_active (day, user_id) VALUES (?, ?)", [(day, uid) for uid in seen]
+            )
+            new = db.total_changes - before
+            if new:
+                counts = {**counts, ("dau", ""): counts.get(("dau", ""), 0) + new}
+        await db.executemany(
+            "INSERT INTO daily_stats (day, metric, key, value) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(day, metric, key) DO UPDATE SET value = value + excluded.value",
+            [(day, metric, key, n) for (metric, key), n in counts.items()],
+        )
+        await db.commit()
+
+async def set_daily_gauge(db_path: str, day: str, metric: str, value: int) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute(
+            "INSERT INTO daily_stats (day, metric, key, value) VALUES (?, ?, '', ?) "
+            "ON CONFLICT(day, metric, key) DO UPDATE SET value = excluded.value",
+            (day, metric, value),
+        )
+        await db.commit()
+
+DAILY_STATS_SELECT = "SELECT day, metric, key, value FROM daily_stats WHERE day>=?"
+
+async def daily_stats_since(db_path: str, day: str) -> list[tuple[str, str, str, int]]:
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(DAILY_STATS_SELECT, (day,))
+        return [(r[0], r[1], r[2], int(r[3])) for r in await cur.fetchall()]
+
+ACTIVE_PAID_COUNT = "SELECT COUNT(*) FROM users WHERE access_until>?"
+
+async def count_active_paid(db_path: str) -> int:
+    async with aiosqlite.connect(db_path) as db:
+        cur = await db.execute(ACTIVE_PAID_COUNT, (now_ts(),))
+        return int((await cur.fetchone())[0])
+
+async def purge_daily_active(db_path: str, before_day: str) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute("DELETE FROM daily_active WHERE day<?", (before_day,))
+        await db.commit()
+
+
+# Queries on hot paths, with sample parameters. Each must be answered from an
+# index; explain_hot_queries() reports any that fall back to a table scan or a
+# temp B-tree (sort, grouping or DISTINCT). The SQL is the same constant the
+# function above runs, so the check can't drift from the code.
+HOT_QUERIES = {
+    "journal_newer": (JOURNAL_NEWER_SELECT, (1, 0, 8)),
+    "journal_older": (JOURNAL_OLDER_SELECT, (1, 1000, 8)),
+    "search_journal": (JOURNAL_SEARCH_SELECT, ('"btc"', 1, 8)),
+    "list_favorites": (FAVORITES_SELECT, (1, 30)),
+    "favorites_for_users": (FAVORITES_FOR_USERS_SELECT.format(marks="?,?,?"), (1, 2, 3)),
+    "get_open_tickets": (OPEN_TICKETS_SELECT, (20,)),
+    "open_tickets_page": (OPEN_TICKETS_PAGE_SELECT, (1000, 11)),
+    "ticket_by_thread": (TICKET_BY_THREAD_SELECT, (1,)),
+    "ticket_by_group_message": (TICKET_BY_GROUP_MESSAGE_SELECT, (1,)),
+    "ticket_history": (TICKET_HISTORY_SELECT, (1, 15)),
+    "invite_issued": (INVITE_ISSUED_SELECT, (1, 1, 0)),
+    "invite_pop": (INVITE_POP_UPDATE, (1, 0, 1, 0)),
+    "broadcast_chunk": (BROADCAST_RECIPIENTS_SELECT, (0, 0, 200)),
+    "access_expiring": (USERS_EXPIRING_SELECT, (0, 86400, 0, 0, "1d", 500)),
+    "count_active_paid": (ACTIVE_PAID_COUNT, (0,)),
+    "admin_stats": (DAILY_STATS_SELECT, ("2000-01-01",)),
+    "digest_due": (DIGEST_DUE_SELECT, (600, "2000-01-01", 0, 500)),
+}
+
+async def explain_hot_queries(db_path: str) -> dict[str, list[str]]:
+    bad: dict[str, list[str]] = {}
+    async with aiosqlite.connect(db_path) as db:
+        for name, (sql, params) in HOT_QUERIES.items():
+            cur = await db.execute("EXPLAIN QUERY PLAN " + sql, params)
+            details = [r[3] for r in await cur.fetchall()]
+            problems = [d for d in details if (d.startswith("SCAN ") and "INDEX" not in d) or "TEMP B-TREE" in d]
+            if problems:
+                bad[name] = problems
+    return bad
+
+
+# One span per call while an update is being traced.
+instrument_module(globals(), "db")
@@ -0,0 +1,105 @@
+import asyncio
+import html
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from aiogram.utils.markdown import hbold, hcode
+
+from . import db
+from .charts import add_ma30, detect_regime
+from .coins import pick_movers
+from .market import MarketUnavailable
+
+# Daily digest: symbols are fetched and classified once per run across all
+# due users, so cost follows the number of distinct favorites, not users.
+
+DIGEST_TF = "15m"
+DIGEST_BARS_24H = 96
+DIGEST_FAVORITES = 10
+DIGEST_BATCH = 500
+FETCH_CONCURRENCY = 8
+
+
+def parse_digest_time(text: str) -> int | None:
+    # "HH:MM" -> minutes after local midnight; raises ValueError if malformed.
+    hh, mm = text.strip().split(":")
+    h, m = int(hh), int(mm)
+    if not (0 <= h < 24 and 0 <= m < 60):
+        raise ValueError(text)
+    return h * 60 + m
+
+
+def fmt_minute(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+async def symbol_line(market, symbol: str) -> str:
+    try:
+        res = await market.ohlcv(symbol, DIGEST_TF)
+    except MarketUnavailable:
+        return f"{hcode(symbol)} — н/д"
+    c = add_ma30(res.value)
+    if not len(c):
+        return f"{hcode(symbol)} — н/д"
+    close = c.close
+    base = close[-DIGEST_BARS_24H - 1] if len(close) > DIGEST_BARS_24H else close[0]
+    pct = (close[-1] / base - 1) * 100 if base else 0.0
+    return f"{hcode(symbol)} — {close[-1]:.6g} ({pct:+.1f}%) • {detect_regime(c)}"
+
+
+async def symbol_lines(market, symbols: set[str]) -> dict[str, str]:
+    sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async def one(sym: str) -> tuple[str, str]:
+        async with sem:
+            return sym, await symbol_line(market, sym)
+
+    return dict(await asyncio.gather(*(one(s) for s in symbols)))
+
+
+async def movers_block(market) -> str:
+    try:
+        items = (await market.usdt_changes()).value
+    except MarketUnavailable:
+        return ""
+    fmt = lambda rows: ", ".join(f"{html.escape(s.split('/')[0])} {p:+.1f}%" for s, p in rows)
+    return (
+        f"🚀 Рост: {fmt(pick_movers(items, 3, 'gainers'))}\n"
+        f"📉 Падение: {fmt(pick_movers(items, 3, 'losers'))}"
+    )
+
+
+def render_digest(day: str, favorites: list[str], lines: dict[str, str], movers: str) -> str:
+    parts = [f"☀️ {hbold('Дайджест')} {day}"]
+    if favorites:
+        parts.append(f"⭐ Избранное ({DIGEST_TF}, 24ч):\n" + "\n".join(lines[s] for s in favorites))
+    else:
+        parts.append("⭐ Избранное пусто — добавь монеты в 🪙 Монеты.")
+    if movers:
+        parts.append(movers)
+    parts.append("⚠️ Не финсовет.")
+    return "\n\n".join(parts)
+
+
+async def send_digests(cfg, market, sendq) -> None:
+    now = datetime.now(ZoneInfo(cfg.tz))
+    minute = now.hour * 60 + now.minute
+    day = now.date().isoformat()
+    lines: dict[str, str] = {}
+    movers = None
+    sent = 0
+    while batch := await db.users_due_digest(cfg.db_path, minute, day, DIGEST_BATCH):
+        favs = await db.favorites_for_users(cfg.db_path, batch, DIGEST_FAVORITES)
+        missing = {s for syms in favs.values() for s in syms} - lines.keys()
+        if missing:
+            lines.update(await symbol_lines(market, missing))
+        if movers is None:
+            movers = await movers_block(market)
+        # Marked before sending: a crash mid-batch skips a day rather than
+        # sending the digest twice.
+        await db.mark_digest_sent(cfg.db_path, batch, day)
+        for uid in batch:
+            await sendq.enqueue_message(uid, render_digest(day, favs.get(uid, []), lines, movers))
+        sent += len(batch)
+    if sent:
+        print(f"[jobs] digest users={sent} symbols={len(lines)}")
@@ -0,0 +1,67 @@
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from . import db
+
+LINK_TTL = 24 * 3600
+# A pooled link is only handed out if it stays valid at least this long.
+MIN_REMAINING = 3600
+
+
+class InviteLinkPool:
+    # Single-use private channel links are created ahead of time by a background
+    # job, so issuing one on click is a local DB pop instead of two API calls.
+
+    def __init__(self, bot: Bot, db_path: str, chat_id: int, chat_type: str | None, size: int):
+        self.bot = bot
+        self.db_path = db_path
+        self.chat_id = chat_id
+        self.chat_type = chat_type
+        self.size = size
+
+    @property
+    def single_use(self) -> bool:
+        # member_limit supported for supergroup, but not for channel chats;
+        # there a link is tied to one user and revoked on first join instead.
+        return self.chat_type == "supergroup"
+
+    async def _create(self) -> tuple[str, int]:
+        expires_at = int(time.time()) + LINK_TTL
+        kwargs = {"member_limit": 1} if self.single_use else {}
+        link = await self.bot.create_chat_invite_link(chat_id=self.chat_id, expire_date=expires_at, **kwargs)
+        return link.invite_link, expires_at
+
+    async def refill(self) -> None:
+        if self.chat_type is None:
+            self.chat_type = (await self.bot.get_chat(self.chat_id)).type
+        now = int(time.time())
+        await db.purge_invite_links(self.db_path, self.chat_id, now)
+        missing = self.size - await db.count_free_invite_links(self.db_path, self.chat_id, now + MIN_REMAINING)
+        created = []
+        try:
+            for _ in range(missing):
+                created.append(await self._create())
+        except TelegramRetryAfter as e:
+            print(f"[invites] flood limit, retry_after={e.retry_after}")
+        finally:
+            if created:
+                await db.add_invite_links(self.db_path, self.chat_id, created)
+
+    async def issue(self, user_id: int) -> str:
+        now = int(time.time())
+        link = await db.pop_invite_link(self.db_path, self.chat_id, user_id, now + MIN_REMAINING)
+        if link:
+            return link
+        # Pool exhausted (or not filled yet): fall back to creating one live.
+        link, expires_at = await self._create()
+        await db.add_invite_links(self.db_path, self.chat_id, [(link, expires_at)], user_id=user_id)
+        return link
+
+    async def on_join(self, link: str) -> None:
+        if await db.mark_invite_link_used(self.db_path, link):
+            try:
+                await self.bot.revoke_chat_invite_link(self.chat_id, link)
+            except Exception as e:
+                print(f"[invites] revoke failed error={e}")
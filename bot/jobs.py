@@ -0,0 +1,133 @@
+import asyncio
+from datetime import timedelta
+
+from aiogram.exceptions import TelegramBadRequest
+
+from . import db
+from .digest import send_digests
+from .keyboards import kb_access
+from .texts import fmt_ts
+
+DAY = 86400
+# (notice kind, window start, window end) relative to now; windows don't overlap,
+# so a user close to expiry gets only the nearest reminder.
+REMINDER_WINDOWS = [("3d", DAY, 3 * DAY), ("1d", 0, DAY)]
+# Lapsed users are looked up in a bounded window, so the cost stays O(expiring).
+EXPIRED_LOOKBACK = 7 * DAY
+
+
+async def run_periodic(name: str, interval: float, fn, *args, lease=None) -> None:
+    # With a lease, only the worker holding it runs the job.
+    while True:
+        try:
+            if lease is None or await lease.held():
+                await fn(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[jobs] {name} failed: {e}")
+        await asyncio.sleep(interval)
+
+
+async def expire_pending_payments(cfg) -> None:
+    n = await db.expire_stale_payments(cfg.db_path, timedelta(minutes=cfg.payment_pending_ttl_min))
+    if n:
+        print(f"[jobs] payments_expired count={n}")
+
+
+async def revoke_channel_access(cfg, bot, sendq, user_id: int) -> bool:
+    # Removes the user from the private channel and revokes any invite link
+    # issued to them. Calls go through the send queue (global pace, RetryAfter
+    # retries). They are queued under the user's id, not the channel's: admin
+    # calls aren't bound by the per-group message limit, and this keeps them
+    # behind the user's "expired" message. True if the user was removed;
+    # otherwise the next run tries again.
+    channel_id = int(cfg.private_channel_id)
+
+    async def kick():
+        # ban + unban removes the user without leaving them banned, so they
+        # can rejoin after renewing.
+        await bot.ban_chat_member(channel_id, user_id)
+        await bot.unban_chat_member(channel_id, user_id, only_if_banned=True)
+
+    links = await db.issued_invite_links(cfg.db_path, channel_id, user_id)
+    futs = [await sendq.enqueue(user_id, kick)]
+    futs += [await sendq.enqueue(user_id, lambda l=l: bot.revoke_chat_invite_link(channel_id, l)) for l in links]
+    results = await asyncio.gather(*futs, return_exceptions=True)
+    for link, res in zip(links, results[1:]):
+        # A link Telegram already considers invalid is as good as revoked.
+        if not isinstance(res, BaseException) or isinstance(res, TelegramBadRequest):
+            await db.mark_invite_link_used(cfg.db_path, link)
+    if isinstance(results[0], BaseException):
+        print(f"[jobs] revoke failed user_id={user_id} error={results[0]}")
+        return False
+    return True
+
+
+async def revoke_expired(cfg, bot, sendq, now: int) -> None:
+    # "revoked" is recorded separately from the "expired" notice and only
+    # for users actually removed, so failures are retried on the next run.
+    after = None
+    while batch := await db.users_expiring(cfg.db_path, now - EXPIRED_LOOKBACK, now, "revoked", after=after):
+        results = await asyncio.gather(*(revoke_channel_access(cfg, bot, sendq, uid) for uid, _ in batch))
+        done = [item for item, ok in zip(batch, results) if ok]
+        await db.mark_access_notices(cfg.db_path, "revoked", done)
+        print(f"[jobs] access_revoked count={len(done)} failed={len(batch) - len(done)}")
+        after = batch[-1]
+
+
+async def process_access_expiry(cfg, bot, sendq) -> None:
+    now = db.now_ts()
+    for kind, lo, hi in REMINDER_WINDOWS:
+        while batch := await db.users_expiring(cfg.db_path, now + lo, now + hi, kind):
+            for uid, until in batch:
+                await sendq.enqueue_message(
+                    uid,
+                    f"⏳ Доступ заканчивается {fmt_ts(until, cfg.tz)}. Продлить: ⭐ Доступ.",
+                    reply_markup=kb_access(),
+                )
+            await db.mark_access_notices(cfg.db_path, kind, batch)
+    while batch := await db.users_expiring(cfg.db_path, now - EXPIRED_LOOKBACK, now, "expired"):
+        for uid, _ in batch:
+            await sendq.enqueue_message(uid, "⌛ Доступ истёк. Продлить: ⭐ Доступ.", reply_markup=kb_access())
+        await db.mark_access_notices(cfg.db_path, "expired", batch)
+        print(f"[jobs] access_expired count={len(batch)}")
+    if cfg.private_channel_id:
+        await revoke_expired(cfg, bot, sendq, now)
+
+
+async def process_broadcasts(cfg, sendq, lease=None) -> None:
+    job = await db.next_broadcast(cfg.db_path)
+    if not job:
+        return
+    cursor, sent = int(job["cursor_user_id"]), int(job["sent"])
+    while ids := await db.active_user_ids_after(cfg.db_path, cursor, 200):
+        # Re-check per chunk so a long broadcast keeps the lease renewed and
+        # stops if another worker has taken over.
+        if lease is not None and not await lease.held():
+            return
+        futs = [await sendq.enqueue_message(uid, f"📣 {job['text']}") for uid in ids]
+        results = await asyncio.gather(*futs, return_exceptions=True)
+        ok = sum(1 for r in results if not isinstance(r, BaseException))
+        cursor, sent = ids[-1], sent + ok
+        await db.advance_broadcast(cfg.db_path, job["id"], cursor, ok)
+    await db.finish_broadcast(cfg.db_path, job["id"])
+    if job["notify_chat_id"]:
+        sendq.send_message(int(job["notify_chat_id"]), f"✅ Рассылка #{job['id']} завершена. Разослано: {sent}")
+
+
+def start_jobs(cfg, bot, sendq, invites=None, lease=None, market=None, analytics=None) -> list[asyncio.Task]:
+    tasks = [
+        asyncio.create_task(run_periodic("payments_reconcile", 300, expire_pending_payments, cfg, lease=lease)),
+        asyncio.create_task(
+            run_periodic("access_expiry", 600, process_access_expiry, cfg, bot, sendq, lease=lease)
+        ),
+        asyncio.create_task(run_periodic("broadcasts", 2, process_broadcasts, cfg, sendq, lease, lease=lease)),
+    ]
+    if market is not None:
+        tasks.append(asyncio.create_task(run_periodic("digest", 60, send_digests, cfg, market, sendq, lease=lease)))
+    if analytics is not None:
+        tasks.append(asyncio.create_task(run_periodic("analytics_snapshot", 600, analytics.snapshot, lease=lease)))
+    if invites is not None:
+        tasks.append(asyncio.create_task(run_periodic("invite_pool", 60, invites.refill, lease=lease)))
+    return tasks
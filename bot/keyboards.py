@@ -1,6 +1,33 @@
+from functools import lru_cache, wraps
+
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardMarkup
 
+
+# Static keyboards are built once at import and the same markup object is
+# returned on every call; handlers must treat markups as read-only.
+def _frozen(builder):
+    markup = builder()
+
+    @wraps(builder)
+    def get() -> InlineKeyboardMarkup:
+        return markup
+
+    get.build = builder
+    return get
+
+
+# Parameterized keyboards are memoized per argument tuple, bounded so that
+# user-supplied symbols can't grow the cache without limit.
+def _memoized(maxsize: int):
+    def deco(builder):
+        cached = lru_cache(maxsize=maxsize)(builder)
+        cached.build = builder
+        return cached
+    return deco
+
+
+@_frozen
 def kb_main() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     for text, cb in [
@@ -20,6 +47,7 @@ def kb_main() -> InlineKeyboardMarkup:
     b.adjust(2,2,2,2,2,1)
     return b.as_markup()
 
+@_frozen
 def kb_access() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.button(text="📜 Дисклеймер", callback_data="access:disclaimer")
@@ -30,6 +58,7 @@ def kb_access() -> InlineKeyboardMarkup:
     b.adjust(1,1,1,1,1)
     return b.as_markup()
 
+@_frozen
 def kb_support() -> InlineKeyboardMarkup:
     b=InlineKeyboardBuilder()
     b.button(text="✉️ Создать тикет", callback_data="support:new")
@@ -37,23 +66,37 @@ def kb_support() -> InlineKeyboardMarkup:
     b.adjust(1,1)
     return b.as_markup()
 
+@_memoized(256)
 def kb_ticket_admin(ticket_id: int) -> InlineKeyboardMarkup:
     b=InlineKeyboardBuilder()
     b.button(text="↩️ Ответить", callback_data=f"admin:tickets:reply:{ticket_id}")
     b.button(text="✅ Закрыть", callback_data=f"admin:tickets:close:{ticket_id}")
-    b.adjust(2)
+    b.button(text="📜 История", callback_data=f"admin:tickets:view:{ticket_id}")
+    b.adjust(2,1)
+    return b.as_markup()
+
+def kb_tickets_page(ticket_ids: list[int], next_before: int | None) -> InlineKeyboardMarkup:
+    b=InlineKeyboardBuilder()
+    for tid in ticket_ids:
+        b.button(text=f"#{tid}", callback_data=f"admin:tickets:view:{tid}")
+    if next_before is not None:
+        b.button(text="Дальше ➡️", callback_data=f"admin:tickets:page:{next_before}")
+    b.adjust(*([5] * (len(ticket_ids) // 5) + ([len(ticket_ids) % 5] if len(ticket_ids) % 5 else [])), 1)
     return b.as_markup()
 
+@_frozen
 def kb_admin_panel() -> InlineKeyboardMarkup:
     b=InlineKeyboardBuilder()
     b.button(text="📥 Тикеты (open)", callback_data="admin:tickets:open")
     b.button(text="📣 Рассылка", callback_data="admin:broadcast:new")
     b.button(text="➕ Whitelist добавить", callback_data="admin:whitelist:add")
     b.button(text="➖ Whitelist убрать", callback_data="admin:whitelist:remove")
+    b.button(text="📊 Статистика", callback_data="admin:stats")
     b.button(text="⬅️ Назад", callback_data="nav:back:main")
-    b.adjust(2,2,1)
+    b.adjust(2,2,1,1)
     return b.as_markup()
 
+@_frozen
 def kb_coins_menu() -> InlineKeyboardMarkup:
     b=InlineKeyboardBuilder()
     b.button(text="📈 Топ рост", callback_data="coins:gainers")
@@ -64,6 +107,7 @@ def kb_coins_menu() -> InlineKeyboardMarkup:
     b.adjust(2,2,1)
     return b.as_markup()
 
+@_memoized(1024)
 def kb_symbol_actions(symbol: str, is_fav: bool) -> InlineKeyboardMarkup:
     b=InlineKeyboardBuilder()
     b.button(text="✅ Сделать активной", callback_data=f"coins:set:{symbol}")
@@ -73,6 +117,7 @@ def kb_symbol_actions(symbol: str, is_fav: bool) -> InlineKeyboardMarkup:
     b.adjust(1,1,1,1)
     return b.as_markup()
 
+@_frozen
 def kb_chart_tf() -> InlineKeyboardMarkup:
     b=InlineKeyboardBuilder()
     for tf in ["1m","5m","15m","30m"]:
@@ -81,10 +126,36 @@ def kb_chart_tf() -> InlineKeyboardMarkup:
     b.adjust(4,1)
     return b.as_markup()
 
+@_frozen
 def kb_journal() -> InlineKeyboardMarkup:
     b=InlineKeyboardBuilder()
     b.button(text="➕ Добавить запись", callback_data="journal:add")
     b.button(text="🗂 Последние записи", callback_data="journal:list")
+    b.button(text="🔎 Поиск", callback_data="journal:search")
+    b.button(text="📤 Экспорт", callback_data="journal:export")
+    b.button(text="📈 Статистика", callback_data="journal:stats")
     b.button(text="⬅️ Назад", callback_data="nav:back:main")
-    b.adjust(1,1,1)
+    b.adjust(1,1,2,1,1)
+    return b.as_markup()
+
+@_frozen
+def kb_journal_stats() -> InlineKeyboardMarkup:
+    b=InlineKeyboardBuilder()
+    b.button(text="📉 Кривая капитала", callback_data="journal:equity")
+    b.button(text="⬅️ Назад", callback_data="main:journal")
+    b.adjust(1)
+    return b.as_markup()
+
+@_memoized(1024)
+def kb_journal_page(older_id: int | None, newer_id: int | None) -> InlineKeyboardMarkup:
+    b=InlineKeyboardBuilder()
+    nav = 0
+    if newer_id is not None:
+        b.button(text="⬅️ Новее", callback_data=f"journal:page:newer:{newer_id}")
+        nav += 1
+    if older_id is not None:
+        b.button(text="Старее ➡️", callback_data=f"journal:page:older:{older_id}")
+        nav += 1
+    b.button(text="⬅️ Назад", callback_data="main:journal")
+    b.adjust(*([nav, 1] if nav else [1]))
     return b.as_markup()
@@ -0,0 +1,204 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+import ccxt
+
+from .charts import fetch_ohlcv
+from .coins import fetch_usdt_changes
+from .tracing import annotate, traced
+
+
+class MarketUnavailable(Exception):
+    pass
+
+
+class UnknownSymbol(MarketUnavailable):
+    # The exchange rejected the symbol; retrying won't help.
+    pass
+
+
+def _transient(e: BaseException) -> bool:
+    # Only these say something about the exchange's health and are worth a
+    # retry; request errors (bad symbol, bad params) fail once and don't
+    # count toward the breaker.
+    return isinstance(e, (ccxt.NetworkError, TimeoutError, OSError))
+
+
+@dataclass(frozen=True)
+class Fetched:
+    value: object
+    age: float
+    stale: bool
+
+
+def _consume(fut: asyncio.Future) -> None:
+    if not fut.cancelled():
+        fut.exception()
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures; after `reset_after` seconds
+    # one trial call is let through (half-open) and its outcome closes or
+    # re-opens the breaker.
+
+    def __init__(self, threshold: int = 5, reset_after: float = 30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def release(self) -> None:
+        # Ends a half-open trial whose outcome says nothing about the exchange.
+        self._trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+
+class MarketData:
+    # Stale-while-revalidate cache in front of the exchange. Fresh entries are
+    # served directly; stale ones are served (marked stale) while one
+    # background refresh runs; misses fetch through hedged retries guarded by
+    # a circuit breaker. If a fetch fails, the last good value is served.
+
+    def __init__(
+        self,
+        exchange=None,
+        fresh_ttl: float = 20.0,
+        max_stale: float = 3600.0,
+        hedge_after: float = 1.5,
+        timeout: float = 10.0,
+        max_attempts: int = 3,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.exchange = exchange or ccxt.gateio({"enableRateLimit": True, "timeout": int(timeout * 1000)})
+        self.fresh_ttl = fresh_ttl
+        self.max_stale = max_stale
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker()
+        self._cache: dict[tuple, tuple[object, float]] = {}
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    @traced("market.ohlcv")
+    async def ohlcv(self, symbol: str, timeframe: str, limit: int = 220) -> Fetched:
+        return await self._get(
+            ("ohlcv", symbol, timeframe, limit), lambda: fetch_ohlcv(symbol, timeframe, limit, ex=self.exchange)
+        )
+
+    @traced("market.usdt_changes")
+    async def usdt_changes(self) -> Fetched:
+        return await self._get(("usdt_changes",), lambda: fetch_usdt_changes(self.exchange))
+
+    async def _get(self, key: tuple, fn) -> Fetched:
+        entry = self._cache.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            age = now - entry[1]
+            if age < self.fresh_ttl:
+                self.hits += 1
+                annotate(cache="fresh")
+                return Fetched(entry[0], age, False)
+            if age < self.max_stale:
+                self.stale_hits += 1
+                annotate(cache="stale")
+                self._start(key, fn).add_done_callback(_consume)
+                return Fetched(entry[0], age, True)
+        self.misses += 1
+        annotate(cache="miss")
+        try:
+            value = await asyncio.shield(self._start(key, fn))
+        except MarketUnavailable:
+            entry = self._cache.get(key)
+            if entry is None:
+                raise
+            return Fetched(entry[0], time.monotonic() - entry[1], True)
+        return Fetched(value, 0.0, False)
+
+    def _start(self, key: tuple, fn) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _refresh(self, key: tuple, fn):
+        if not self.breaker.allow():
+            raise MarketUnavailable("circuit open")
+        try:
+            value = await self._hedged(fn)
+        except Exception as e:
+            if _transient(e):
+                self.breaker.failure()
+                raise MarketUnavailable(str(e) or type(e).__name__) from e
+            self.breaker.release()
+            err = UnknownSymbol if isinstance(e, ccxt.BadSymbol) else MarketUnavailable
+            raise err(str(e) or type(e).__name__) from e
+        self.breaker.success()
+        self._cache[key] = (value, time.monotonic())
+        return value
+
+    async def _hedged(self, fn):
+        # Starts a second attempt if the first is slower than hedge_after, or
+        # retries right away if an attempt fails transiently; the first
+        # success wins. A non-transient error is raised as is.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        pending: set[asyncio.Future] = set()
+        attempts = 0
+        hedge_due = False
+        error: BaseException | None = None
+        try:
+            while True:
+                if attempts < self.max_attempts and (not pending or hedge_due):
+                    pending.add(asyncio.ensure_future(asyncio.to_thread(fn)))
+                    attempts += 1
+                remaining = deadline - loop.time()
+                if not pending or remaining <= 0:
+                    break
+                wait_for = min(self.hedge_after, remaining) if attempts < self.max_attempts else remaining
+                done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                hedge_due = not done
+                for t in done:
+                    if t.exception() is None:
+                        return t.result()
+                    error = t.exception()
+                    if not _transient(error):
+                        raise error
+        finally:
+            # Threads can't be cancelled; losing attempts finish in the background.
+            for t in pending:
+                t.add_done_callback(_consume)
+        raise error or TimeoutError("exchange timeout")
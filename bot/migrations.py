@@ -0,0 +1,238 @@
+import aiosqlite
+
+# Each step runs once, in order, inside its own transaction; PRAGMA user_version
+# records the last applied step. A step is either an SQL script or an async
+# callable taking the connection. Never edit a step that has shipped - append.
+
+
+async def _add_column(db: aiosqlite.Connection, table: str, column: str, decl: str) -> None:
+    cur = await db.execute(f"PRAGMA table_info({table})")
+    cols = {r[1] for r in await cur.fetchall()}
+    if column not in cols:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+async def _m1_payments(db: aiosqlite.Connection) -> None:
+    await _add_column(db, "payments", "telegram_payment_charge_id", "TEXT")
+    await db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_charge_id ON payments(telegram_payment_charge_id)"
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_status_created ON payments(status, created_at)")
+
+
+async def _m3_journal_fts(db: aiosqlite.Connection) -> None:
+    for stmt in (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS journal_fts USING fts5(text, content='journal_entries', content_rowid='id')",
+        """CREATE TRIGGER IF NOT EXISTS journal_fts_ai AFTER INSERT ON journal_entries BEGIN
+             INSERT INTO journal_fts(rowid, text) VALUES (new.id, new.text);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS journal_fts_ad AFTER DELETE ON journal_entries BEGIN
+             INSERT INTO journal_fts(journal_fts, rowid, text) VALUES ('delete', old.id, old.text);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS journal_fts_au AFTER UPDATE OF text ON journal_entries BEGIN
+             INSERT INTO journal_fts(journal_fts, rowid, text) VALUES ('delete', old.id, old.text);
+             INSERT INTO journal_fts(rowid, text) VALUES (new.id, new.text);
+           END""",
+        "INSERT INTO journal_fts(journal_fts) VALUES ('rebuild')",
+    ):
+        await db.execute(stmt)
+
+
+async def _m4_ticket_threads(db: aiosqlite.Connection) -> None:
+    await _add_column(db, "tickets", "thread_id", "INTEGER")
+    await _add_column(db, "tickets", "group_message_id", "INTEGER")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_thread ON tickets(thread_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_group_message ON tickets(group_message_id)")
+
+
+async def _m5_access_until_epoch(db: aiosqlite.Connection) -> None:
+    # SQLite can't change a column type in place, so rebuild users with
+    # access_until as epoch seconds.
+    for stmt in (
+        "DROP INDEX IF EXISTS idx_users_whitelisted",
+        "DROP INDEX IF EXISTS idx_users_access_until",
+        "ALTER TABLE users RENAME TO users_old",
+        """CREATE TABLE users (
+             user_id INTEGER PRIMARY KEY,
+             username TEXT,
+             created_at TEXT NOT NULL,
+             is_whitelisted INTEGER NOT NULL DEFAULT 0,
+             access_until INTEGER,
+             active_symbol TEXT,
+             accepted_disclaimer_at TEXT
+           )""",
+        """INSERT INTO users (user_id, username, created_at, is_whitelisted, access_until, active_symbol, accepted_disclaimer_at)
+           SELECT user_id, username, created_at, is_whitelisted, CAST(strftime('%s', access_until) AS INTEGER),
+                  active_symbol, accepted_disclaimer_at
+           FROM users_old""",
+        "DROP TABLE users_old",
+        # Partial, so the planner can only use it for the whitelist lookup and
+        # never prefers it over the access_until range.
+        "CREATE INDEX idx_users_whitelisted ON users(user_id) WHERE is_whitelisted=1",
+        "CREATE INDEX idx_users_access_until ON users(access_until)",
+        """CREATE TABLE IF NOT EXISTS access_notices (
+             user_id INTEGER NOT NULL,
+             access_until INTEGER NOT NULL,
+             kind TEXT NOT NULL,
+             sent_at TEXT NOT NULL,
+             PRIMARY KEY (user_id, access_until, kind)
+           ) WITHOUT ROWID""",
+    ):
+        await db.execute(stmt)
+
+
+async def _m6_invite_links(db: aiosqlite.Connection) -> None:
+    for stmt in (
+        """CREATE TABLE IF NOT EXISTS invite_links (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             chat_id INTEGER NOT NULL,
+             link TEXT NOT NULL UNIQUE,
+             created_at TEXT NOT NULL,
+             expires_at INTEGER NOT NULL,
+             user_id INTEGER,
+             issued_at INTEGER,
+             revoked_at INTEGER
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_invite_links_free ON invite_links(chat_id, expires_at) "
+        "WHERE user_id IS NULL AND revoked_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_invite_links_user ON invite_links(user_id, chat_id) "
+        "WHERE user_id IS NOT NULL AND revoked_at IS NULL",
+    ):
+        await db.execute(stmt)
+
+
+async def _m9_digest(db: aiosqlite.Connection) -> None:
+    # Local time of the daily digest in minutes after midnight (NULL = off).
+    await _add_column(db, "users", "digest_minute", "INTEGER")
+    await _add_column(db, "users", "digest_sent_on", "TEXT")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_digest ON users(digest_minute) WHERE digest_minute IS NOT NULL"
+    )
+
+
+async def _m10_trades(db: aiosqlite.Connection) -> None:
+    for stmt in (
+        """CREATE TABLE IF NOT EXISTS trades (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             journal_id INTEGER NOT NULL UNIQUE,
+             user_id INTEGER NOT NULL,
+             symbol TEXT NOT NULL,
+             side TEXT NOT NULL,
+             entry REAL NOT NULL,
+             exit REAL NOT NULL,
+             stop REAL,
+             r REAL,
+             pnl REAL,
+             pnl_pct REAL NOT NULL,
+             regime TEXT NOT NULL,
+             tags TEXT NOT NULL,
+             created_at TEXT NOT NULL
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_trades_user ON trades(user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_trades_user_symbol ON trades(user_id, symbol)",
+        """CREATE TABLE IF NOT EXISTS trade_stats (
+             user_id INTEGER NOT NULL,
+             dim TEXT NOT NULL,
+             key TEXT NOT NULL,
+             n INTEGER NOT NULL,
+             wins INTEGER NOT NULL,
+             sum_pnl_pct REAL NOT NULL,
+             sum_pnl REAL NOT NULL,
+             n_r INTEGER NOT NULL,
+             sum_r REAL NOT NULL,
+             PRIMARY KEY (user_id, dim, key)
+           ) WITHOUT ROWID""",
+    ):
+        await db.execute(stmt)
+    # No backfill: notes written before trade parsing existed are free text,
+    # and only notes added from now on are treated as trades.
+
+
+MIGRATIONS = [
+    (1, _m1_payments),
+    (2, """
+CREATE INDEX IF NOT EXISTS idx_journal_user_id ON journal_entries(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites(user_id, created_at, symbol);
+CREATE INDEX IF NOT EXISTS idx_tickets_status_id ON tickets(status, ticket_id);
+CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket ON ticket_messages(ticket_id, id);
+CREATE INDEX IF NOT EXISTS idx_users_whitelisted ON users(is_whitelisted);
+CREATE INDEX IF NOT EXISTS idx_users_access_until ON users(access_until);
+"""),
+    (3, _m3_journal_fts),
+    (4, _m4_ticket_threads),
+    (5, _m5_access_until_epoch),
+    (6, _m6_invite_links),
+    (7, """
+CREATE TABLE IF NOT EXISTS candles (
+  symbol TEXT NOT NULL,
+  timeframe TEXT NOT NULL,
+  ts INTEGER NOT NULL,
+  open REAL NOT NULL,
+  high REAL NOT NULL,
+  low REAL NOT NULL,
+  close REAL NOT NULL,
+  volume REAL NOT NULL,
+  PRIMARY KEY (symbol, timeframe, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS backtest_cache (
+  key TEXT PRIMARY KEY,
+  created_at INTEGER NOT NULL,
+  result TEXT NOT NULL
+);
+"""),
+    (8, """
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  text TEXT NOT NULL,
+  notify_chat_id INTEGER,
+  status TEXT NOT NULL,
+  cursor_user_id INTEGER NOT NULL DEFAULT 0,
+  sent INTEGER NOT NULL DEFAULT 0,
+  created_at TEXT NOT NULL,
+  finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status, id);
+"""),
+    (9, _m9_digest),
+    (10, _m10_trades),
+    (11, """
+CREATE TABLE IF NOT EXISTS daily_stats (
+  day TEXT NOT NULL,
+  metric TEXT NOT NULL,
+  key TEXT NOT NULL,
+  value INTEGER NOT NULL,
+  PRIMARY KEY (day, metric, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_active (
+  day TEXT NOT NULL,
+  user_id INTEGER NOT NULL,
+  PRIMARY KEY (day, user_id)
+) WITHOUT ROWID;
+"""),
+]
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    # Expects a connection opened with isolation_level=None.
+    cur = await db.execute("PRAGMA user_version")
+    version = (await cur.fetchone())[0]
+    for v, step in MIGRATIONS:
+        if v <= version:
+            continue
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            if callable(step):
+                await step(db)
+            else:
+                for stmt in step.split(";"):
+                    if stmt.strip():
+                        await db.execute(stmt)
+            await db.execute(f"PRAGMA user_version={v}")
+            await db.execute("COMMIT")
+        except Exception:
+            await db.execute("ROLLBACK")
+            raise
+        print(f"[db] migrated to version {v}")
+        version = v
+    return version
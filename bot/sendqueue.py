@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+# Telegram allows ~30 messages/s overall, 1/s into one private chat and
+# 20/min into one group; stay a bit under each.
+GLOBAL_RATE = 25.0
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+MAX_ATTEMPTS = 3
+# RetryAfter is usually one chat's limit and only delays that chat. From this
+# many chats within FLOOD_WINDOW seconds it's taken as the bot-wide limit and
+# pauses every send.
+GLOBAL_FLOOD_CHATS = 3
+FLOOD_WINDOW = 1.0
+
+
+def _consume(fut: asyncio.Future) -> None:
+    # Fire-and-forget sends are allowed; don't warn about unretrieved errors.
+    if not fut.cancelled():
+        fut.exception()
+
+
+class SendQueue:
+    # Each chat has its own FIFO; chats wait in a heap keyed by the time
+    # their next send is allowed. One dispatcher takes the earliest due chat,
+    # spends a global rate slot on it and starts the call, so a slow group
+    # never holds back sends to other chats. A chat has at most one call in
+    # flight, which keeps its messages in order.
+
+    def __init__(self, bot: Bot, rate: float = GLOBAL_RATE, workers: int = 8, maxsize: int = 10000, limiter=None):
+        self.bot = bot
+        self.rate = rate
+        # Optional coord.SharedRateLimiter: caps the total across bot workers,
+        # on top of this process's own pacing.
+        self.limiter = limiter
+        self.maxsize = maxsize
+        self._inflight = asyncio.Semaphore(workers)
+        self._chats: dict[int, deque] = {}
+        self._heap: list[tuple[float, int, int]] = []
+        self._seq = itertools.count()
+        # Chats that are in the heap or have a call in flight.
+        self._scheduled: set[int] = set()
+        self._chat_next: dict[int, float] = {}
+        self._next_slot = 0.0
+        self._floods: dict[int, float] = {}
+        self._size = 0
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._task, *self._running) if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for q in self._chats.values():
+            for _, fut, _, _ in q:
+                fut.cancel()
+        self._chats.clear()
+        self._task = None
+
+    def submit(self, chat_id: int, call) -> asyncio.Future:
+        # call: zero-argument callable returning the Bot API coroutine.
+        if self._size >= self.maxsize:
+            raise asyncio.QueueFull
+        return self._add(chat_id, call)
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        return self.submit(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs))
+
+    async def enqueue(self, chat_id: int, call) -> asyncio.Future:
+        # For bulk producers: waits for room in the queue instead of raising QueueFull.
+        while self._size >= self.maxsize:
+            self._room.clear()
+            await self._room.wait()
+        return self._add(chat_id, call)
+
+    async def enqueue_message(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        return await self.enqueue(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs))
+
+    def _add(self, chat_id: int, call) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(_consume)
+        self._size += 1
+        # The call later runs in the submitter's context, so a send queued
+        # from a traced update still gets its span in that trace.
+        self._chats.setdefault(chat_id, deque()).append((call, fut, 1, contextvars.copy_context()))
+        self._schedule(chat_id)
+        return fut
+
+    def _schedule(self, chat_id: int) -> None:
+        if chat_id in self._scheduled or not self._chats.get(chat_id):
+            return
+        self._scheduled.add(chat_id)
+        heapq.heappush(self._heap, (self._chat_next.get(chat_id, 0.0), next(self._seq), chat_id))
+        self._wakeup.set()
+
+    async def _wait(self, timeout: float | None) -> None:
+        # Sleeps until `timeout` passes or a new chat is scheduled.
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._heap:
+                await self._wait(None)
+                continue
+            wait = self._heap[0][0] - time.monotonic()
+            if wait > 0:
+                await self._wait(wait)
+                continue
+            # Global gates are passed only once some chat is due; the heap top
+            # can only get earlier meanwhile, so it is still due afterwards.
+            if self._next_slot > time.monotonic():
+                await asyncio.sleep(self._next_slot - time.monotonic())
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            await self._inflight.acquire()
+            _, _, chat_id = heapq.heappop(self._heap)
+            item = self._chats[chat_id].popleft()
+            now = time.monotonic()
+            self._next_slot = max(now, self._next_slot) + 1.0 / self.rate
+            self._chat_next[chat_id] = now + (GROUP_CHAT_INTERVAL if chat_id < 0 else PRIVATE_CHAT_INTERVAL)
+            if len(self._chat_next) > 10000:
+                self._chat_next = {k: v for k, v in self._chat_next.items() if v > now or k in self._scheduled}
+            t = asyncio.create_task(self._send(chat_id, item))
+            self._running.add(t)
+            t.add_done_callback(self._running.discard)
+
+    async def _send(self, chat_id: int, item) -> None:
+        call, fut, attempt, ctx = item
+        done = True
+        try:
+            if fut.cancelled():
+                return
+            result = await asyncio.create_task(call(), context=ctx)
+            if not fut.done():
+                fut.set_result(result)
+        except TelegramRetryAfter as e:
+            now = time.monotonic()
+            until = now + e.retry_after
+            self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), until)
+            self._floods[chat_id] = now
+            self._floods = {k: t for k, t in self._floods.items() if now - t <= FLOOD_WINDOW}
+            if len(self._floods) >= GLOBAL_FLOOD_CHATS:
+                self._next_slot = max(self._next_slot, until)
+            if attempt < MAX_ATTEMPTS:
+                self._chats.setdefault(chat_id, deque()).appendleft((call, fut, attempt + 1, ctx))
+                done = False
+            else:
+                print(f"[sendqueue] chat_id={chat_id} failed: {e}")
+                if not fut.done():
+                    fut.set_exception(e)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            print(f"[sendqueue] chat_id={chat_id} failed: {e}")
+            if not fut.done():
+                fut.set_exception(e)
+        finally:
+            self._inflight.release()
+            if done:
+                self._size -= 1
+                self._room.set()
+            self._scheduled.discard(chat_id)
+            if self._chats.get(chat_id):
+                self._schedule(chat_id)
+            else:
+                self._chats.pop(chat_id, None)
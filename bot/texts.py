@@ -1,3 +1,13 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+
+def fmt_ts(ts: int | None, tz: str) -> str:
+    if not ts:
+        return "—"
+    return datetime.fromtimestamp(int(ts), ZoneInfo(tz)).strftime("%Y-%m-%d %H:%M")
+
+
 DECISION_BRIEF = (
 "🧭 DECISION (коротко)\n\n"
 "1) 15m MA30 ↑ → TREND → Trailing/Swing\n"
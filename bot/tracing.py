@@ -0,0 +1,229 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import Update
+
+# Per-update tracing. TracingMiddleware opens a root span for each update and
+# stores it in a contextvar; traced()/span() open child spans only while a
+# root is active, so with tracing off (middleware not installed, or update not
+# sampled) a traced call costs one ContextVar.get().
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "ts", "start", "ms", "attrs", "error", "spans")
+
+    def __init__(self, trace_id: str, parent_id: str | None, name: str, attrs: dict, spans: list):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(4)
+        self.parent_id = parent_id
+        self.name = name
+        self.ts = time.time()
+        self.start = time.perf_counter()
+        self.ms = 0.0
+        self.attrs = attrs
+        self.error = None
+        # Shared by every span of the trace; the root exports it.
+        self.spans = spans
+        spans.append(self)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "name": self.name,
+                "ts": round(self.ts, 6),
+                "ms": round(self.ms, 3),
+                "attrs": self.attrs,
+                "error": self.error,
+                "pid": os.getpid(),
+            },
+            ensure_ascii=False,
+        )
+
+
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("trace_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    s = Span(parent.trace_id, parent.span_id, name, attrs, parent.spans)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = repr(e)[:200]
+        raise
+    finally:
+        s.ms = (time.perf_counter() - s.start) * 1000
+        _current.reset(token)
+
+
+def annotate(**attrs) -> None:
+    s = _current.get()
+    if s is not None:
+        s.attrs.update(attrs)
+
+
+def traced(name: str):
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if _current.get() is None:
+                    return await fn(*args, **kwargs)
+                with span(name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if _current.get() is None:
+                    return fn(*args, **kwargs)
+                with span(name):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def instrument_module(namespace: dict, prefix: str) -> None:
+    # Wraps every public coroutine function defined in the module.
+    for name, obj in list(namespace.items()):
+        if (
+            not name.startswith("_")
+            and inspect.iscoroutinefunction(obj)
+            and obj.__module__ == namespace["__name__"]
+        ):
+            namespace[name] = traced(f"{prefix}.{name}")(obj)
+
+
+class Tracer:
+    # sample: share of updates exported to `path` in full.
+    # slow_ms: updates slower than this are always exported and logged.
+    # Finished traces are serialized and appended by a writer thread, so the
+    # event loop never blocks on the file; if the writer falls behind by
+    # `backlog` traces, new ones are dropped.
+    def __init__(self, path: str, sample: float = 0.0, slow_ms: float = 0.0, backlog: int = 1000):
+        self.path = path
+        self.sample = sample
+        self.slow_ms = slow_ms
+        self.dropped = 0
+        self._queue: queue.Queue[list[Span] | None] = queue.Queue(backlog)
+        self._writer: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample > 0 or self.slow_ms > 0
+
+    def begin(self, name: str, attrs: dict) -> Span | None:
+        sampled = random.random() < self.sample
+        if not sampled and not self.slow_ms:
+            return None
+        root = Span(secrets.token_hex(8), None, name, attrs, [])
+        root.attrs["sampled"] = sampled
+        return root
+
+    def end(self, root: Span) -> None:
+        root.ms = (time.perf_counter() - root.start) * 1000
+        slow = bool(self.slow_ms) and root.ms >= self.slow_ms
+        if slow:
+            children = sorted(root.spans[1:], key=lambda s: s.ms, reverse=True)[:4]
+            parts = ", ".join(f"{s.name}={s.ms:.0f}ms" for s in children)
+            print(f"[trace] slow {root.name} {root.ms:.0f}ms trace_id={root.trace_id} {root.attrs} {parts}")
+        if not (slow or root.attrs["sampled"]):
+            return
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+            self._writer.start()
+        try:
+            # A copy: queued sends may still add spans to the trace later.
+            self._queue.put_nowait(list(root.spans))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                print(f"[trace] writer behind, dropped {self.dropped} traces")
+
+    def close(self) -> None:
+        # Blocks until queued traces are written; call at shutdown.
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _write_loop(self) -> None:
+        while (spans := self._queue.get()) is not None:
+            batch = [spans]
+            # Drain whatever else is queued, so a burst is one open/write.
+            while True:
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    self._queue.put(None)
+                    break
+                batch.append(more)
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(s.to_json() + "\n" for spans in batch for s in spans))
+            except OSError as e:
+                print(f"[trace] export failed: {e}")
+
+
+def update_attrs(update: Update) -> dict:
+    attrs = {"update_id": update.update_id, "type": update.event_type}
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        attrs["user_id"] = user.id
+    data = getattr(event, "data", None)
+    if isinstance(data, str):
+        attrs["data"] = data[:64]
+    text = getattr(event, "text", None)
+    if isinstance(text, str) and text.startswith("/"):
+        # Command name only; message text is never exported.
+        attrs["command"] = text.split(maxsplit=1)[0][:32]
+    return attrs
+
+
+class TracingMiddleware(BaseMiddleware):
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler, event: Update, data: dict):
+        root = self.tracer.begin(f"update.{event.event_type}", update_attrs(event))
+        if root is None:
+            return await handler(event, data)
+        token = _current.set(root)
+        try:
+            return await handler(event, data)
+        except BaseException as e:
+            root.error = repr(e)[:200]
+            raise
+        finally:
+            _current.reset(token)
+            self.tracer.end(root)
+
+
+class TracingSessionMiddleware(BaseRequestMiddleware):
+    # One span per outgoing Bot API call made inside a traced update.
+    async def __call__(self, make_request, bot, method):
+        if _current.get() is None:
+            return await make_request(bot, method)
+        with span(f"bot.{type(method).__name__}"):
+            return await make_request(bot, method)
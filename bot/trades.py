@@ -0,0 +1,218 @@
+import re
+from dataclasses import dataclass
+
+from .charts import REGIMES
+
+# Trade entries are ordinary journal notes that also name a symbol, a side
+# and entry/exit prices, e.g.
+#   BTC long 65000 -> 66200 sl 64000 #breakout #trend
+#   ETH/USDT шорт вход 3400 выход 3310 pnl +45 r 1.2
+# Such notes are additionally stored as rows in `trades`, and per-user
+# aggregates in `trade_stats` are updated in the same transaction.
+# The format is deliberately strict: prices only via an arrow or the
+# entry/exit keywords, and the symbol either carries a quote suffix or sits
+# right next to the side word. Plain notes must never turn into trades.
+
+# A number is taken whole or not at all: the atomic group can't give back
+# digits, and the lookarounds stop a match from starting or ending inside a
+# longer number ("65,000", "65 500", "1,234.5"). _num() then decides what
+# the separators mean.
+_DIGITS = r"(?>\d+(?:[.,]\d+)*(?:[ \u00a0]\d{3}(?!\d))*)"
+_BEFORE_NUM = r"(?<![\d.,])(?<!\d[ \u00a0])"
+_AFTER_NUM = r"(?![.,]?\d)"
+_NUM = _BEFORE_NUM + "(" + _DIGITS + ")" + _AFTER_NUM
+_SIGNED = _BEFORE_NUM + "([+-]?" + _DIGITS + ")" + _AFTER_NUM
+_SIDE = re.compile(r"(?<!\w)(long|short|buy|sell|лонг|шорт)(?!\w)", re.I)
+_QUOTED = re.compile(r"(?<![\w#/])([A-Z0-9]{2,15}/(?:USDT|USDC|USD|BTC|ETH))(?![\w/])", re.I)
+_TOKEN = r"([A-Z][A-Z0-9]{1,14})"
+_BEFORE_SIDE = re.compile(r"(?<![\w#/])" + _TOKEN + r"\s+$")
+_AFTER_SIDE = re.compile(r"^\s+" + _TOKEN + r"(?![\w/])")
+_ARROW = re.compile(_NUM + r"\s*(?:->|→|=>)\s*" + _NUM)
+_ENTRY = re.compile(r"(?<!\w)(?:entry|вход)\s*[:=]?\s*" + _NUM, re.I)
+_EXIT = re.compile(r"(?<!\w)(?:exit|выход)\s*[:=]?\s*" + _NUM, re.I)
+_STOP = re.compile(r"(?<!\w)(?:sl|stop|стоп)\s*[:=]?\s*" + _NUM, re.I)
+_R = re.compile(r"(?<!\w)r\s*[:=]?\s*" + _SIGNED + r"(?!\w)", re.I)
+_PNL = re.compile(r"(?<!\w)(?:pnl|пнл)\s*[:=]?\s*" + _SIGNED, re.I)
+_TAG = re.compile(r"#([\w/-]{1,32})")
+
+_SHORT = {"short", "sell", "шорт"}
+# Words that look like tickers but aren't: order terms and TA abbreviations.
+_NOT_SYMBOLS = {
+    "LONG", "SHORT", "BUY", "SELL", "SL", "TP", "STOP", "PNL", "ROI", "ENTRY", "EXIT",
+    "RSI", "MACD", "EMA", "SMA", "MA", "BB", "ATR", "VWAP", "OBV", "ADX", "DCA", "ATH", "ATL",
+    "OI", "TA", "FOMO", "FUD", "USD", "USDT", "USDC",
+}
+
+
+def _num(s: str) -> float | None:
+    # "65000", "0,5", "66200.5", "1,234.5", "1.234,5", "1,234,567". None when
+    # the reading is ambiguous ("65,000" could be 65 or 65000; "65 500" could
+    # be two numbers): better a plain note than a wrong trade in the stats.
+    sign = -1.0 if s[0] == "-" else 1.0
+    s = s.lstrip("+-")
+    if " " in s or "\u00a0" in s:
+        return None
+    seps = [c for c in s if c in ".,"]
+    if not seps:
+        return sign * float(s)
+    groups, dec = seps[:-1], seps[-1]
+    if not groups and dec == ".":
+        return sign * float(s)
+    if not groups:
+        whole, frac = s.split(",")
+        if len(frac) == 3 and whole != "0":
+            return None
+        return sign * float(f"{whole}.{frac}")
+    thousands = groups[0]
+    if any(c != thousands for c in groups):
+        return None
+    if dec == thousands:
+        whole, frac = s, ""
+    else:
+        whole, frac = s.rsplit(dec, 1)
+    parts = whole.split(thousands)
+    if not 1 <= len(parts[0]) <= 3 or any(len(p) != 3 for p in parts[1:]):
+        return None
+    return sign * float("".join(parts) + ("." + frac if frac else ""))
+
+
+@dataclass(frozen=True)
+class Trade:
+    symbol: str
+    side: str
+    entry: float
+    exit: float
+    stop: float | None
+    r: float | None
+    pnl: float | None
+    pnl_pct: float
+    regime: str
+    tags: tuple[str, ...]
+
+    @property
+    def win(self) -> bool:
+        return (self.pnl if self.pnl is not None else self.pnl_pct) > 0
+
+    def stat_keys(self) -> list[tuple[str, str]]:
+        return [("all", ""), ("symbol", self.symbol), ("regime", self.regime)] + [("tag", t) for t in self.tags]
+
+    def summary(self) -> str:
+        r = f" ({self.r:+.2f}R)" if self.r is not None else ""
+        return f"{self.symbol} {self.side.upper()} {self.pnl_pct:+.2f}%{r}"
+
+
+def _find_symbol(text: str, side_m: re.Match) -> str | None:
+    quoted = _QUOTED.search(text)
+    if quoted:
+        return quoted.group(1).upper()
+    for m in (_AFTER_SIDE.match(text[side_m.end():]), _BEFORE_SIDE.search(text[: side_m.start()])):
+        if m and m.group(1) not in _NOT_SYMBOLS:
+            return m.group(1) + "/USDT"
+    return None
+
+
+def parse_trade(text: str) -> Trade | None:
+    side_m = _SIDE.search(text)
+    if not side_m:
+        return None
+    symbol = _find_symbol(text, side_m)
+    if symbol is None:
+        return None
+    arrow = _ARROW.search(text)
+    if arrow:
+        entry, exit_ = _num(arrow.group(1)), _num(arrow.group(2))
+    else:
+        e, x = _ENTRY.search(text), _EXIT.search(text)
+        if not e or not x:
+            return None
+        entry, exit_ = _num(e.group(1)), _num(x.group(1))
+    if entry is None or exit_ is None or entry <= 0 or exit_ <= 0:
+        return None
+
+    side = "short" if side_m.group(1).lower() in _SHORT else "long"
+    sign = -1 if side == "short" else 1
+    stop_m, r_m, pnl_m = _STOP.search(text), _R.search(text), _PNL.search(text)
+    stop = _num(stop_m.group(1)) if stop_m else None
+    r = _num(r_m.group(1)) if r_m else None
+    pnl = _num(pnl_m.group(1)) if pnl_m else None
+    if (stop_m and stop is None) or (r_m and r is None) or (pnl_m and pnl is None):
+        return None
+    if r is None and stop is not None and stop != entry:
+        r = sign * (exit_ - entry) / abs(entry - stop)
+    tags = tuple(dict.fromkeys(t.lower() for t in _TAG.findall(text)))
+    regime = next((t.upper() for t in tags if t.upper() in REGIMES), "UNKNOWN")
+    return Trade(
+        symbol=symbol,
+        side=side,
+        entry=entry,
+        exit=exit_,
+        stop=stop,
+        r=r,
+        pnl=pnl,
+        pnl_pct=sign * (exit_ / entry - 1) * 100,
+        regime=regime,
+        tags=tags,
+    )
+
+
+STATS_UPSERT = """
+INSERT INTO trade_stats (user_id, dim, key, n, wins, sum_pnl_pct, sum_pnl, n_r, sum_r)
+VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT(user_id, dim, key) DO UPDATE SET
+  n = n + 1,
+  wins = wins + excluded.wins,
+  sum_pnl_pct = sum_pnl_pct + excluded.sum_pnl_pct,
+  sum_pnl = sum_pnl + excluded.sum_pnl,
+  n_r = n_r + excluded.n_r,
+  sum_r = sum_r + excluded.sum_r
+"""
+
+
+def stats_params(user_id: int, t: Trade) -> list[tuple]:
+    return [
+        (user_id, dim, key, int(t.win), t.pnl_pct, t.pnl or 0.0, int(t.r is not None), t.r or 0.0)
+        for dim, key in t.stat_keys()
+    ]
+
+
+TRADE_INSERT = """
+INSERT INTO trades (journal_id, user_id, symbol, side, entry, exit, stop, r, pnl, pnl_pct, regime, tags, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def trade_params(journal_id: int, user_id: int, t: Trade, created_at: str) -> tuple:
+    return (
+        journal_id, user_id, t.symbol, t.side, t.entry, t.exit, t.stop, t.r, t.pnl, t.pnl_pct,
+        t.regime, " ".join(t.tags), created_at,
+    )
+
+
+def _stat_line(label: str, s: dict) -> str:
+    wr = s["wins"] / s["n"] * 100
+    avg_r = f" • {s['sum_r'] / s['n_r']:+.2f}R" if s["n_r"] else ""
+    return f"{label} — {s['n']} • {wr:.0f}% • {s['sum_pnl_pct']:+.1f}%{avg_r}"
+
+
+def format_stats(rows: list[dict], top: int = 8) -> str:
+    by_dim: dict[str, list[dict]] = {}
+    for r in rows:
+        by_dim.setdefault(r["dim"], []).append(r)
+    total = by_dim.get("all")
+    if not total:
+        return (
+            "📈 Сделок пока нет.\n\nЗапиши сделку в журнал, например:\n"
+            "<code>BTC long 65000 -> 66200 sl 64000 #trend</code>"
+        )
+    t = total[0]
+    avg_r = f"{t['sum_r'] / t['n_r']:+.2f}" if t["n_r"] else "—"
+    parts = [
+        "📈 Статистика сделок\n\n"
+        f"Сделок: {t['n']} • Win rate: {t['wins'] / t['n'] * 100:.0f}% • Avg R: {avg_r}\n"
+        f"Σ PnL: {t['sum_pnl_pct']:+.2f}%" + (f" ({t['sum_pnl']:+.2f})" if t["sum_pnl"] else "")
+    ]
+    for dim, title in (("symbol", "По символам"), ("regime", "По режимам"), ("tag", "По тегам")):
+        items = sorted(by_dim.get(dim, []), key=lambda s: s["n"], reverse=True)[:top]
+        if items:
+            parts.append(f"{title} (сделок • win • Σ% • avg R):\n" + "\n".join(_stat_line(s["key"], s) for s in items))
+    return "\n\n".join(parts)
@@ -0,0 +1,38 @@
+import asyncio
+import sqlite3
+
+from bot import db
+from bot.backtest import PAGE_LIMIT, TIMEFRAMES, _fetch_range
+
+STEP = TIMEFRAMES["15m"] * 1000
+
+
+class WindowedExchange:
+    # Like gate with `since`: a fixed from/to window, empty before the listing.
+    def __init__(self, listed_ms: int):
+        self.listed_ms = listed_ms
+        self.calls = 0
+
+    def fetch_ohlcv(self, symbol, timeframe, since, limit):
+        self.calls += 1
+        start = max(since, self.listed_ms)
+        end = since + limit * STEP
+        return [[ts, 1.0, 1.0, 1.0, 1.0, 1.0] for ts in range(start, end, STEP)]
+
+
+def test_fetch_range_skips_windows_before_listing(tmp_path):
+    path = str(tmp_path / "bot.db")
+    asyncio.run(db.init_db(path))
+    start = 0
+    listed = start + 3 * PAGE_LIMIT * STEP + 7 * STEP
+    end = listed + 500 * STEP
+    ex = WindowedExchange(listed)
+    con = sqlite3.connect(path)
+    try:
+        _fetch_range(ex, con, "NEW/USDT", "15m", start, end)
+        n, lo = con.execute("SELECT COUNT(*), MIN(ts) FROM candles WHERE symbol='NEW/USDT'").fetchone()
+    finally:
+        con.close()
+    assert lo == listed
+    assert n >= 500
+    assert ex.calls == 4
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from bot.cluster import shard_key
+from bot.coord import CoordStorage, InvalidationBus, LocalCache, SQLiteBackend
+
+
+def run_with_backends(tmp_path, fn):
+    # Two backends on one file, as two worker processes would have.
+    async def main():
+        a, b = SQLiteBackend(str(tmp_path / "coord.db")), SQLiteBackend(str(tmp_path / "coord.db"))
+        await a.init()
+        await b.init()
+        try:
+            return await fn(a, b)
+        finally:
+            await a.close()
+            await b.close()
+    return asyncio.run(main())
+
+
+def test_lease_takeover_and_expiry(tmp_path):
+    async def check(a, b):
+        assert await a.acquire_lease("jobs", "w0", ttl=0.3)
+        assert not await b.acquire_lease("jobs", "w1", ttl=0.3)
+        # Renewal by the holder keeps it.
+        await asyncio.sleep(0.2)
+        assert await a.acquire_lease("jobs", "w0", ttl=0.3)
+        await asyncio.sleep(0.2)
+        assert not await b.acquire_lease("jobs", "w1", ttl=0.3)
+        # Once it expires, the other worker takes it over.
+        await asyncio.sleep(0.4)
+        assert await b.acquire_lease("jobs", "w1", ttl=0.3)
+        assert not await a.acquire_lease("jobs", "w0", ttl=0.3)
+    run_with_backends(tmp_path, check)
+
+
+def test_incr_counts_per_window(tmp_path):
+    async def check(a, b):
+        window = 0.5
+        await asyncio.sleep(window - time.time() % window + 0.01)
+        assert [await a.incr("send", window), await b.incr("send", window), await a.incr("send", window)] == [1, 2, 3]
+        await asyncio.sleep(window)
+        assert await b.incr("send", window) == 1
+        assert await a.incr("other", window) == 1
+    run_with_backends(tmp_path, check)
+
+
+def test_publish_poll(tmp_path):
+    async def check(a, b):
+        start = await b.last_event_id()
+        await a.publish("invalidate", "access:1")
+        await a.publish("other", "x")
+        events = await b.poll("invalidate", start)
+        assert [m for _, m in events] == ["access:1"]
+        assert await b.poll("invalidate", events[-1][0]) == []
+    run_with_backends(tmp_path, check)
+
+
+def test_invalidation_reaches_other_worker(tmp_path):
+    async def check(a, b):
+        bus_a, bus_b = InvalidationBus(a, interval=0.05), InvalidationBus(b, interval=0.05)
+        cache_a = LocalCache(bus_a, "access", ttl=60)
+        cache_b = LocalCache(bus_b, "access", ttl=60)
+        loads = []
+
+        async def loader():
+            loads.append(1)
+            return True
+
+        task = asyncio.create_task(bus_b.run())
+        try:
+            await asyncio.sleep(0.1)
+            await cache_b.get_or_load(42, loader)
+            await cache_b.get_or_load(42, loader)
+            assert len(loads) == 1
+            await cache_a.invalidate(42)
+            await asyncio.sleep(0.2)
+            await cache_b.get_or_load(42, loader)
+            assert len(loads) == 2
+        finally:
+            task.cancel()
+    run_with_backends(tmp_path, check)
+
+
+def test_storage_round_trip(tmp_path):
+    async def check(a, b):
+        key = StorageKey(bot_id=1, chat_id=2, user_id=3)
+        sa, sb = CoordStorage(a), CoordStorage(b)
+        await sa.set_state(key, "Journal:awaiting_text")
+        await sa.set_data(key, {"symbol": "BTC/USDT", "page": 2})
+        assert await sb.get_state(key) == "Journal:awaiting_text"
+        assert await sb.get_data(key) == {"symbol": "BTC/USDT", "page": 2}
+        await sb.set_state(key, None)
+        await sb.set_data(key, {})
+        assert await sa.get_state(key) is None
+        assert await sa.get_data(key) == {}
+    run_with_backends(tmp_path, check)
+
+
+def test_shard_key():
+    assert shard_key({"update_id": 1, "message": {"from": {"id": 5}, "chat": {"id": -10}}}) == 5
+    assert shard_key({"update_id": 2, "callback_query": {"id": "q", "from": {"id": 6}, "data": "x"}}) == 6
+    member = {
+        "chat": {"id": -10},
+        "from": {"id": 7},
+        "new_chat_member": {"user": {"id": 8}},
+        "old_chat_member": {"user": {"id": 8}},
+    }
+    assert shard_key({"update_id": 3, "chat_member": member}) == 7
+    assert shard_key({"update_id": 4, "channel_post": {"chat": {"id": -20}}}) == -20
+    assert shard_key({"update_id": 5}) == 0
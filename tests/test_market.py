@@ -0,0 +1,132 @@
+# Fault injection for bot.market.MarketData against a local fake exchange:
+# slow primary (hedging), outage (stale serving + circuit breaker), recovery,
+# and bad symbols, which must not count as exchange failures.
+import asyncio
+import threading
+import time
+
+import ccxt
+import pytest
+
+from bot.market import CircuitBreaker, MarketData, MarketUnavailable, UnknownSymbol
+
+
+class FakeExchange:
+    # ccxt-shaped stand-in. Set `fail` to raise, `latency` to delay each call,
+    # or `slow_first` to delay only every other call (a slow replica). Symbols
+    # starting with "BAD" raise ccxt.BadSymbol.
+    def __init__(self):
+        self.fail = False
+        self.latency = 0.0
+        self.slow_first = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        delay = self.latency + (self.slow_first if n % 2 else 0.0)
+        if delay:
+            time.sleep(delay)
+        if self.fail:
+            raise ccxt.NetworkError("fake exchange down")
+
+    def fetch_ohlcv(self, symbol, timeframe="15m", limit=220):
+        self._enter()
+        if symbol.startswith("BAD"):
+            raise ccxt.BadSymbol(f"gateio does not have market symbol {symbol}")
+        t0 = 1_700_000_000_000
+        return [[t0 + i * 900_000, 100.0, 101.0, 99.0, 100.0 + i * 0.01, 10.0] for i in range(limit)]
+
+    def fetch_tickers(self):
+        self._enter()
+        return {"AAA/USDT": {"percentage": 5.0}, "BBB/USDT": {"percentage": -3.0}, "CCC/BTC": {"percentage": 1.0}}
+
+
+def make_market(ex: FakeExchange) -> MarketData:
+    return MarketData(
+        exchange=ex, fresh_ttl=0.2, hedge_after=0.1, timeout=2.0, breaker=CircuitBreaker(threshold=3, reset_after=0.5)
+    )
+
+
+def test_fresh_then_cached():
+    async def check():
+        ex = FakeExchange()
+        md = make_market(ex)
+        r = await md.ohlcv("AAA/USDT", "15m")
+        assert not r.stale and len(r.value) == 220
+        await md.ohlcv("AAA/USDT", "15m")
+        assert ex.calls == 1 and md.hits == 1
+    asyncio.run(check())
+
+
+def test_slow_primary_is_hedged():
+    async def check():
+        ex = FakeExchange()
+        ex.slow_first = 1.0
+        md = make_market(ex)
+        t0 = time.perf_counter()
+        r = await md.ohlcv("BBB/USDT", "15m")
+        assert not r.stale
+        assert time.perf_counter() - t0 < 0.5
+    asyncio.run(check())
+
+
+def test_outage_serves_stale_and_opens_breaker_then_recovers():
+    async def check():
+        ex = FakeExchange()
+        md = make_market(ex)
+        await md.ohlcv("AAA/USDT", "15m")
+        await asyncio.sleep(0.3)
+        ex.fail = True
+        r = await md.ohlcv("AAA/USDT", "15m")
+        assert r.stale, "expected last good value marked stale"
+
+        for _ in range(3):
+            with pytest.raises(MarketUnavailable):
+                await md.ohlcv("ZZZ/USDT", "15m")
+        assert md.breaker.state == "open"
+        calls = ex.calls
+        for _ in range(5):
+            with pytest.raises(MarketUnavailable):
+                await md.ohlcv("ZZZ/USDT", "15m")
+        assert ex.calls == calls, "breaker open must not hit the exchange"
+
+        ex.fail = False
+        await asyncio.sleep(0.6)
+        r = await md.ohlcv("ZZZ/USDT", "15m")
+        assert not r.stale and md.breaker.state == "closed"
+    asyncio.run(check())
+
+
+def test_bad_symbols_fail_once_and_leave_breaker_closed():
+    async def check():
+        ex = FakeExchange()
+        md = make_market(ex)
+        for i in range(5):
+            with pytest.raises(UnknownSymbol):
+                await md.ohlcv(f"BAD{i}/USDT", "15m")
+        assert ex.calls == 5, "bad symbols must not be retried or hedged"
+        assert md.breaker.state == "closed"
+        r = await md.ohlcv("AAA/USDT", "15m")
+        assert not r.stale and len(r.value) == 220
+    asyncio.run(check())
+
+
+def test_bad_symbol_releases_half_open_trial():
+    async def check():
+        ex = FakeExchange()
+        md = make_market(ex)
+        ex.fail = True
+        for _ in range(3):
+            with pytest.raises(MarketUnavailable):
+                await md.ohlcv("ZZZ/USDT", "15m")
+        ex.fail = False
+        await asyncio.sleep(0.6)
+        with pytest.raises(UnknownSymbol):
+            await md.ohlcv("BAD/USDT", "15m")
+        # The trial gave no verdict, so the next call is let through.
+        r = await md.ohlcv("AAA/USDT", "15m")
+        assert not r.stale and md.breaker.state == "closed"
+    asyncio.run(check())
@@ -0,0 +1,98 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from bot import db
+
+DAY = 86400
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "bot.db")
+    asyncio.run(db.init_db(path))
+    asyncio.run(db.upsert_user(path, 1, "alice"))
+    asyncio.run(db.create_payment(path, 1, "p1", 100))
+    return path
+
+
+def access_until(path: str, user_id: int) -> int | None:
+    con = sqlite3.connect(path)
+    try:
+        return con.execute("SELECT access_until FROM users WHERE user_id=?", (user_id,)).fetchone()[0]
+    finally:
+        con.close()
+
+
+def set_access_until(path: str, user_id: int, value: int) -> None:
+    con = sqlite3.connect(path)
+    try:
+        con.execute("UPDATE users SET access_until=? WHERE user_id=?", (value, user_id))
+        con.commit()
+    finally:
+        con.close()
+
+
+def apply(path: str, payload: str = "p1", user_id: int = 1, amount: int = 100, charge_id: str = "c1") -> str:
+    return asyncio.run(db.apply_payment(path, payload, user_id, amount, charge_id, days=30))
+
+
+def test_repeated_charge_extends_once(db_path):
+    assert apply(db_path) == "ok"
+    until = access_until(db_path, 1)
+    assert apply(db_path) == "duplicate"
+    assert access_until(db_path, 1) == until
+    p = asyncio.run(db.get_payment(db_path, "p1"))
+    assert p["status"] == "paid" and p["telegram_payment_charge_id"] == "c1"
+
+
+def test_paid_payload_rejected_for_new_charge(db_path):
+    assert apply(db_path, charge_id="c1") == "ok"
+    until = access_until(db_path, 1)
+    assert apply(db_path, charge_id="c2") == "duplicate"
+    assert access_until(db_path, 1) == until
+
+
+def test_amount_mismatch(db_path):
+    assert apply(db_path, amount=99) == "mismatch"
+    assert asyncio.run(db.get_payment(db_path, "p1"))["status"] == "pending"
+    assert not access_until(db_path, 1)
+
+
+def test_unknown_payload_or_user(db_path):
+    assert apply(db_path, payload="nope") == "unknown"
+    assert apply(db_path, user_id=2) == "unknown"
+    assert asyncio.run(db.get_payment(db_path, "p1"))["status"] == "pending"
+
+
+def test_extends_from_now_when_lapsed(db_path):
+    set_access_until(db_path, 1, db.now_ts() - 10 * DAY)
+    before = db.now_ts()
+    assert apply(db_path) == "ok"
+    assert before + 30 * DAY <= access_until(db_path, 1) <= db.now_ts() + 30 * DAY
+
+
+def test_extends_from_current_expiry_when_active(db_path):
+    current = db.now_ts() + 5 * DAY
+    set_access_until(db_path, 1, current)
+    assert apply(db_path) == "ok"
+    assert access_until(db_path, 1) == current + 30 * DAY
+
+
+def test_expire_stale_payments_only_old_pending(db_path):
+    old = (datetime.now(timezone.utc) - timedelta(hours=2)).isoformat()
+    asyncio.run(db.create_payment(db_path, 1, "old_pending", 100))
+    asyncio.run(db.create_payment(db_path, 1, "old_paid", 100))
+    asyncio.run(db.create_payment(db_path, 1, "new_pending", 100))
+    assert apply(db_path, payload="old_paid", charge_id="c9") == "ok"
+    con = sqlite3.connect(db_path)
+    try:
+        con.execute("UPDATE payments SET created_at=? WHERE payload IN ('old_pending', 'old_paid')", (old,))
+        con.commit()
+    finally:
+        con.close()
+    assert asyncio.run(db.expire_stale_payments(db_path, timedelta(hours=1))) == 1
+    status = {p: asyncio.run(db.get_payment(db_path, p))["status"] for p in ("old_pending", "old_paid", "new_pending")}
+    assert status == {"old_pending": "expired", "old_paid": "paid", "new_pending": "pending"}
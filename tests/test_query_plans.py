@@ -0,0 +1,22 @@
+# Every hot query must be answered from an index on a freshly migrated
+# database. Run from the repo root: python -m pytest
+import asyncio
+
+from bot import db
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    path = str(tmp_path / "bot.db")
+    asyncio.run(db.init_db(path))
+    assert asyncio.run(db.explain_hot_queries(path)) == {}
+
+
+def test_sorts_are_reported(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.db")
+    asyncio.run(db.init_db(path))
+    monkeypatch.setattr(db, "HOT_QUERIES", {
+        "order_by": ("SELECT id FROM journal_entries WHERE user_id=? ORDER BY created_at", (1,)),
+        "group_by": ("SELECT kind, COUNT(*) FROM access_notices WHERE user_id=? GROUP BY kind", (1,)),
+        "scan": ("SELECT * FROM journal_entries WHERE text=?", ("x",)),
+    })
+    assert set(asyncio.run(db.explain_hot_queries(path))) == {"order_by", "group_by", "scan"}
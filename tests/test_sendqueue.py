@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot.sendqueue import SendQueue
+
+
+class FloodingBot:
+    # Chats in `flood` answer their first message with RetryAfter.
+    def __init__(self, flood: set[int], retry_after: int = 1):
+        self.flood = set(flood)
+        self.retry_after = retry_after
+        self.sent: dict[int, float] = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.flood:
+            self.flood.discard(chat_id)
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "flood", self.retry_after)
+        self.sent[chat_id] = time.monotonic()
+        return text
+
+
+async def _run(flood: set[int]) -> tuple[float, float]:
+    bot = FloodingBot(flood)
+    q = SendQueue(bot, rate=1000)
+    q.start()
+    t0 = time.monotonic()
+    try:
+        flooded = [q.send_message(c, "x") for c in flood]
+        await asyncio.sleep(0.05)
+        await q.send_message(42, "other")
+        other = bot.sent[42] - t0
+        await asyncio.gather(*flooded)
+        return other, max(bot.sent[c] for c in flood) - t0
+    finally:
+        await q.stop()
+
+
+def test_chat_flood_wait_delays_only_that_chat():
+    other, flooded = asyncio.run(_run({100}))
+    assert other < 0.5
+    assert flooded >= 1.0
+
+
+def test_flood_waits_in_many_chats_pause_everything():
+    other, _ = asyncio.run(_run({100, 200, 300}))
+    assert other >= 0.9
@@ -0,0 +1,54 @@
+import pytest
+
+from bot.trades import parse_trade
+
+
+@pytest.mark.parametrize("text, symbol, entry, exit_", [
+    ("BTC long 65000 -> 66200 sl 64000 #breakout #trend", "BTC/USDT", 65000, 66200),
+    ("ETH/USDT шорт вход 3400 выход 3310 pnl +45 r 1.2", "ETH/USDT", 3400, 3310),
+    ("TP hit on SOL long 100 -> 120", "SOL/USDT", 100, 120),
+    ("DOGE buy 0,1 → 0,095 R -1", "DOGE/USDT", 0.1, 0.095),
+    ("BTC long 1,234.5 -> 1,300.0", "BTC/USDT", 1234.5, 1300.0),
+    ("BTC long 1.234,5 -> 1.300,0", "BTC/USDT", 1234.5, 1300.0),
+    ("BTC long 1,234,567 -> 1,300,000", "BTC/USDT", 1234567, 1300000),
+    ("PEPE long 0,125 -> 0,130", "PEPE/USDT", 0.125, 0.13),
+    ("SOL long 145.250 -> 150", "SOL/USDT", 145.25, 150),
+    ("BTC long 65000 -> 66200 2 часа", "BTC/USDT", 65000, 66200),
+])
+def test_parses(text, symbol, entry, exit_):
+    t = parse_trade(text)
+    assert t is not None
+    assert (t.symbol, t.entry, t.exit) == (symbol, pytest.approx(entry), pytest.approx(exit_))
+
+
+@pytest.mark.parametrize("text", [
+    # Not trades at all.
+    "Сегодня LONG по BTC, сидел 5-10 минут",
+    "BTC long 2024-05-01 plan",
+    "went long 100 -> 120",
+    "RSI long 100 -> 120",
+    "BTC long 100 - 110",
+    # Ambiguous numbers: rejected rather than stored wrong.
+    "BTC long 65,000 -> 66200",
+    "BTC long 65 500 -> 66 200",
+    "BTC long 65000 -> 66200 sl 64,000",
+    "BTC long 100 -> 120 500$",
+    "BTC long 1,23,456 -> 1,300",
+    "BTC long 1.234,567.5 -> 1300",
+])
+def test_rejects(text):
+    assert parse_trade(text) is None
+
+
+def test_numbers_are_not_split():
+    # Used to read as 500 -> 66 and 234.5 -> 1.3.
+    assert parse_trade("BTC long 65 500 -> 66 200") is None
+    t = parse_trade("ETH long 1,234.5 -> 1,300.0")
+    assert (t.entry, t.exit) == (1234.5, 1300.0)
+    assert t.pnl_pct == pytest.approx((1300 / 1234.5 - 1) * 100)
+
+
+def test_r_from_stop():
+    t = parse_trade("ETH short 3400 -> 3300 sl 3450")
+    assert t.r == pytest.approx(2.0)
+    assert t.side == "short" and t.pnl_pct > 0